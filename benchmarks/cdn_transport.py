@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+'''
+Downloads the same asset manifest from the norisk CDN over HTTP/1.1 and over
+HTTP/2 and prints how long each transport took. Needs network access.
+
+Usage:
+    python benchmarks/cdn_transport.py norisk-prod [--limit 2000] [--max-concurrency 64] [--rounds 1]
+'''
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+
+async def download_manifest(api, objects:dict, asset_pack:str, target:str) -> tuple[float,int]:
+    size = 0
+    started = time.perf_counter()
+    tasks = []
+    for path, data in objects.items():
+        size += data.get("size", 0)
+        tasks.append(api.download_file(
+            f"https://{api.CDN_HOST}/assets/{asset_pack}/assets/{path}",
+            f"{target}/{path}",
+            target_hash=data.get("hash")
+        ))
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started, size
+
+async def run(args):
+    import config
+    from networking import api
+    from networking.scheduler import get_scheduler
+    config.MAX_CONCURRENCY = args.max_concurrency
+
+    objects = (await api.get_asset_metadata(args.asset_pack)).get("objects", {})
+    objects = dict(list(objects.items())[:args.limit])
+    await api.close_client()
+    print(f"{len(objects)} assets from {args.asset_pack}")
+
+    for transport in ["http1", "http2"] * args.rounds:
+        config.CDN_TRANSPORT = transport
+        api.http_versions.clear()
+        # every transport starts learning its concurrency from scratch
+        get_scheduler().limiters.clear()
+        with tempfile.TemporaryDirectory() as target:
+            elapsed, size = await download_manifest(api, objects, args.asset_pack, target)
+        await api.close_client()
+        print(f"{transport}: {elapsed:6.2f}s  {size / 1024 / 1024 / elapsed:6.2f} MiB/s  {len(objects) / elapsed:7.1f} files/s  {dict(api.http_versions)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare HTTP/1.1 and HTTP/2 for CDN asset downloads")
+    parser.add_argument("asset_pack", help="Asset pack id, e.g. norisk-prod")
+    parser.add_argument("--limit", type=int, default=2000, help="Maximum number of assets to download")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Upper limit for the adaptive download concurrency")
+    parser.add_argument("--rounds", type=int, default=1, help="How often both transports are measured")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(SRC))
+    # config parses the command line on import
+    sys.argv = [sys.argv[0], "-l", "prism"]
+    with tempfile.TemporaryDirectory() as instance:
+        os.chdir(instance)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+'''
+Microbenchmarks for the wrapper's hot paths. Every case runs on generated
+fixtures in a temp dir, nothing touches the network.
+
+Cases:
+    datamanager        DataManager pack resolution on a large generated modpacks-v3
+    datamanager_cached DataManager when the resolved pack is already cached on disk
+    asset_verify_cold  Assetfile.verify over every asset with an empty hash cache
+    asset_verify_warm  Assetfile.verify over every asset with a populated hash cache
+    calc_hash          calc_hash on a single large file
+    jars_scan          scan_local_files plus jars.match_index
+    overlay            build_overlay writing the cosmetics overlay jar from scratch
+    overlay_incremental build_overlay after 2% of the cosmetics changed
+    overlay_noop       build_overlay when the overlay is up to date
+
+Usage:
+    python benchmarks/microbench.py [--only datamanager,overlay] [--repeat 5] [--scale 1]
+                                    [--output results.json] [--baseline baseline.json] [--max-regression 0.1]
+'''
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+RESULTS_VERSION = 1
+MC_VERSION = "1.21.10"
+PACK = "bench-pack"
+# fixture files are dated back so the hash caches racy window doesnt apply to them
+OLD_MTIME = time.time() - 24 * 60 * 60
+
+
+def write_old(path:Path, data:bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, (OLD_MTIME, OLD_MTIME))
+
+def generate_modpacks(rng:random.Random, packs:int, mods_per_pack:int, mod_pool:int) -> dict:
+    '''
+    Generates a modpacks-v3 response where PACK inherits (directly or not) from every other pack
+    '''
+    def mod(i:int) -> dict:
+        return {
+            "id": f"mod-{i}",
+            "source": {"type": "modrinth", "projectId": f"p{i}", "projectSlug": f"mod-{i}"},
+            "compatibility": {
+                version: {"fabric": {"identifier": f"{i}.0.0"}}
+                for version in ("1.21.4", "1.21.8", MC_VERSION)
+            }
+        }
+
+    data = {"repositories": {"norisk": "https://maven.norisk.gg/repository/maven-releases/"}, "packs": {}}
+    for p in range(packs):
+        data["packs"][f"pack-{p}"] = {
+            "displayName": f"Pack {p}",
+            "loaderPolicy": {"default": {"fabric": {"version": "0.17.3"}}},
+            "assets": [f"assets-{p % 7}"],
+            "mods": [mod(rng.randrange(mod_pool)) for _ in range(mods_per_pack)],
+            "inheritsFrom": [f"pack-{i}" for i in rng.sample(range(p), min(p, 3))]
+        }
+    data["packs"][PACK] = {
+        "displayName": "Benchmark",
+        "loaderPolicy": {"default": {"fabric": {"version": "0.17.3"}}},
+        "assets": ["assets-main"],
+        "mods": [mod(rng.randrange(mod_pool)) for _ in range(mods_per_pack)],
+        "inheritsFrom": [f"pack-{p}" for p in range(packs - 1, max(packs - 4, -1), -1)]
+    }
+    return data
+
+def generate_assets(rng:random.Random, count:int) -> list:
+    '''
+    Writes count small assets below ASSET_PATH
+
+    Returns:
+        list of Assetfile
+    '''
+    from tasks import get_assets
+    assets = []
+    for i in range(count):
+        path = f"nrc-cosmetics/assets/norisk/textures/{i % 97}/{i}.png"
+        data = rng.randbytes(rng.randint(1024, 8192))
+        write_old(Path(get_assets.ASSET_PATH) / path, data)
+        assets.append(get_assets.Assetfile(path, hashlib.md5(data).hexdigest(), "bench", len(data)))
+    return assets
+
+def generate_cosmetics(rng:random.Random, count:int) -> list[Path]:
+    '''
+    Writes count nrc-cosmetics assets, mostly textures plus some compressible models
+    '''
+    from tasks import get_assets
+    files = []
+    for i in range(count):
+        if i % 5 == 0:
+            path = Path(get_assets.ASSET_PATH) / f"nrc-cosmetics/assets/norisk/models/cosmetic_{i}.json"
+            data = json.dumps({"elements": [{"from": [rng.random()] * 3, "to": [rng.random()] * 3} for _ in range(200)]}).encode()
+        else:
+            path = Path(get_assets.ASSET_PATH) / f"nrc-cosmetics/assets/norisk/textures/cosmetics/{i}.png"
+            data = rng.randbytes(rng.randint(4 * 1024, 48 * 1024))
+        write_old(path, data)
+        files.append(path)
+    return files
+
+# every case returns an async function that runs the measured code once and returns extra metrics,
+# run.before is called (untimed) ahead of every run if a case needs to reset its fixtures
+
+def datamanager(rng:random.Random, scale:float, content_hash:str):
+    import config
+    from modpack import DataManager
+    packs = int(80 * scale)
+    data = generate_modpacks(rng, packs, 150, int(4000 * scale))
+    config.NORISK_PACK = PACK
+
+    async def run():
+        manager = DataManager(data, content_hash)
+        return {"packs": packs + 1, "mods": len(manager.mods)}
+    return run
+
+def case_datamanager(rng:random.Random, scale:float):
+    return datamanager(rng, scale, None)
+
+def case_datamanager_cached(rng:random.Random, scale:float):
+    return datamanager(rng, scale, "bench")
+
+def asset_verify(rng:random.Random, scale:float, warm:bool):
+    import hashing
+    from tasks import get_assets
+    assets = generate_assets(rng, int(20000 * scale))
+    cache_path = "cache/asset-hashes.json"
+    if warm:
+        get_assets.hash_cache = hashing.HashCache(cache_path)
+        asyncio.run(get_assets.hash_cache.get_hashes([f"{get_assets.ASSET_PATH}/{a.path}" for a in assets]))
+
+    async def run():
+        await asyncio.gather(*(asset.verify() for asset in assets))
+        if not all(asset.is_verified for asset in assets):
+            raise RuntimeError("asset verification failed")
+        return {"files": len(assets)}
+    if not warm:
+        run.before = lambda: setattr(get_assets, "hash_cache", hashing.HashCache(cache_path))
+    return run
+
+def case_asset_verify_cold(rng:random.Random, scale:float):
+    return asset_verify(rng, scale, warm=False)
+
+def case_asset_verify_warm(rng:random.Random, scale:float):
+    return asset_verify(rng, scale, warm=True)
+
+def case_calc_hash(rng:random.Random, scale:float):
+    import hashing
+    size = int(256 * 1024 * 1024 * scale)
+    block = rng.randbytes(1024 * 1024)
+    with open("big.bin", "wb") as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+
+    async def run():
+        started = time.perf_counter()
+        await hashing.calc_hash("big.bin")
+        return {"mib_per_s": round(size / 1024 / 1024 / (time.perf_counter() - started), 1)}
+    return run
+
+def case_jars_scan(rng:random.Random, scale:float):
+    import config
+    import hashing
+    from tasks import jars
+    config.NRC_MOD_PATH = "mods"
+    count = int(400 * scale)
+    index = []
+    for i in range(count):
+        data = rng.randbytes(rng.randint(32 * 1024, 512 * 1024))
+        path = Path("mods") / f"mod-{i}.jar"
+        write_old(path, data)
+        if i % 10 == 0:
+            # installed by hand or from an older wrapper, has to go through the hash cache
+            continue
+        st = path.stat()
+        index.append({
+            "id": f"mod-{i}",
+            "hash": hashlib.md5(data).hexdigest(),
+            "version": "1.0.0",
+            "filename": path.name,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns
+        })
+    jars.mod_hash_cache = hashing.HashCache("cache/mod-hashes.json")
+
+    async def run():
+        await jars.scan_local_files(index)
+        index_by_id = jars.match_index(index)
+        return {"jars": count, "matched": len(index_by_id)}
+    return run
+
+def overlay(rng:random.Random, scale:float, mode:str):
+    import config
+    from tasks import get_assets
+    config.CACHE_DIR = "cache"
+    files = generate_cosmetics(rng, int(1500 * scale))
+    asyncio.run(get_assets.build_overlay())
+    touched = 0
+
+    def reset():
+        get_assets.overlay_path().with_suffix(".json").unlink(missing_ok=True)
+
+    def touch():
+        # a few assets changed since the last launch
+        nonlocal touched
+        touched += 1
+        for file in files[touched::50]:
+            os.utime(file, (OLD_MTIME + touched, OLD_MTIME + touched))
+
+    async def run():
+        await get_assets.build_overlay()
+        return {"assets": len(files), "jar_mib": round(get_assets.overlay_path().stat().st_size / 1024 / 1024, 1)}
+    if mode == "full":
+        run.before = reset
+    elif mode == "incremental":
+        run.before = touch
+    return run
+
+def case_overlay(rng:random.Random, scale:float):
+    return overlay(rng, scale, "full")
+
+def case_overlay_incremental(rng:random.Random, scale:float):
+    return overlay(rng, scale, "incremental")
+
+def case_overlay_noop(rng:random.Random, scale:float):
+    return overlay(rng, scale, "noop")
+
+CASES = {
+    "datamanager": case_datamanager,
+    "datamanager_cached": case_datamanager_cached,
+    "asset_verify_cold": case_asset_verify_cold,
+    "asset_verify_warm": case_asset_verify_warm,
+    "calc_hash": case_calc_hash,
+    "jars_scan": case_jars_scan,
+    "overlay": case_overlay,
+    "overlay_incremental": case_overlay_incremental,
+    "overlay_noop": case_overlay_noop
+}
+
+
+def run_case(name:str, repeat:int, scale:float, seed:int) -> dict:
+    '''
+    Sets up the fixtures of a case in its own dir, runs it once to warm up and then repeat times
+
+    Returns:
+        {"runs": [seconds...], "median_s", "min_s", "max_s", "metrics"}
+    '''
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix=f"nrc-bench-{name}-") as workdir:
+        os.chdir(workdir)
+        try:
+            run = CASES[name](random.Random(seed), scale)
+            before = getattr(run, "before", None)
+            runs = []
+            metrics = {}
+            for i in range(repeat + 1):
+                if before:
+                    before()
+                if i == 0:
+                    asyncio.run(run())
+                    continue
+                started = time.perf_counter()
+                metrics = asyncio.run(run()) or {}
+                runs.append(time.perf_counter() - started)
+        finally:
+            os.chdir(cwd)
+    return {
+        "runs": [round(r, 6) for r in runs],
+        "median_s": round(statistics.median(runs), 6),
+        "min_s": round(min(runs), 6),
+        "max_s": round(max(runs), 6),
+        "metrics": metrics
+    }
+
+def compare(results:dict, baseline:dict, max_regression:float) -> bool:
+    '''
+    Prints the median of every case against the baseline (to stderr, stdout may carry the json)
+
+    Returns:
+        True if a case got slower than max_regression allows
+    '''
+    regressed = False
+    out = sys.stderr
+    print(f"\n{'case':<20} {'baseline':>10} {'now':>10} {'change':>8}", file=out)
+    for name, result in results["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            print(f"{name:<20} {'-':>10} {result['median_s']:>9.4f}s {'new':>8}", file=out)
+            continue
+        change = result["median_s"] / before["median_s"] - 1
+        flag = ""
+        if change > max_regression:
+            flag = "  REGRESSION"
+            regressed = True
+        print(f"{name:<20} {before['median_s']:>9.4f}s {result['median_s']:>9.4f}s {change:>+7.1%}{flag}", file=out)
+    if baseline.get("scale") != results["scale"]:
+        print(f"WARNING: baseline was recorded with --scale {baseline.get('scale')}", file=out)
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the wrapper's hot paths")
+    parser.add_argument("--only", type=str, help=f"Comma separated cases to run: {','.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="Measured runs per case (after one warm up run)")
+    parser.add_argument("--scale", type=float, default=1, help="Multiplies the fixture sizes")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the fixture generator")
+    parser.add_argument("--output", type=str, help="Writes the results as json to this file")
+    parser.add_argument("--baseline", type=str, help="Results json of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1, help="Allowed slowdown of a case against the baseline (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(CASES)
+    for name in names:
+        if name not in CASES:
+            parser.error(f"unknown case {name}, available: {', '.join(CASES)}")
+
+    sys.path.insert(0, str(SRC))
+    # config parses the command line on import
+    sys.argv = [sys.argv[0], "-l", "prism", "-m", MC_VERSION, "-p", PACK]
+    logging.basicConfig(level=logging.WARNING)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": {}
+    }
+    for name in names:
+        result = run_case(name, args.repeat, args.scale, args.seed)
+        results["results"][name] = result
+        metrics = " ".join(f"{k}={v}" for k, v in result["metrics"].items())
+        print(f"{name:<20} median {result['median_s']:.4f}s  min {result['min_s']:.4f}s  {metrics}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(results, baseline, args.max_regression) else 0)
+
+
+if __name__ == "__main__":
+    main()
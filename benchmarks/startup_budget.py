@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+'''
+Measures the import time of the wrapper with -X importtime and fails if it
+goes over budget or if a module that should be lazy gets imported eagerly.
+
+The budget is relative to the import time of a fixed set of stdlib modules on the
+same machine, so it holds on slow and fast hardware alike. --budget-ms sets an absolute one.
+
+Usage:
+    python benchmarks/startup_budget.py [--budget-ratio 5] [--budget-ms 200] [--forbid duckdb,jwt,aiofiles]
+'''
+import argparse
+import ast
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+
+# get_dependencies is left out since it may run pip
+SKIPPED_IMPORTS = {"tasks.get_dependencies"}
+# stdlib modules of about the weight the wrapper pulls in, the budget is a multiple of their import time
+REFERENCE_IMPORTS = "import asyncio, json, logging, ssl, http.client, zipfile, email.message, decimal"
+
+
+def wrapper_imports() -> str:
+    '''
+    Returns:
+        the top level import statements of __main__, so the budget follows whatever it imports without running main()
+    '''
+    source = (SRC / "__main__.py").read_text()
+    statements = []
+    for node in ast.parse(source).body:
+        if isinstance(node, ast.Import):
+            if any(alias.name in SKIPPED_IMPORTS for alias in node.names):
+                continue
+        elif not isinstance(node, ast.ImportFrom):
+            continue
+        statements.append(ast.get_source_segment(source, node))
+    return "\n".join(statements)
+
+
+def measure(code:str) -> list[tuple[int,int,str]]:
+    '''
+    Args:
+        code: import statements to run in a fresh interpreter
+
+    Returns:
+        list of (self_us, cumulative_us, module) for every module imported
+    '''
+    with tempfile.TemporaryDirectory() as instance:
+        pythonpath = os.pathsep.join(filter(None, [str(SRC), os.environ.get("PYTHONPATH")]))
+        env = dict(os.environ, PYTHONPATH=pythonpath, LAUNCHER_TYPE="prism")
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=instance,
+            env=env,
+            capture_output=True,
+            text=True
+        )
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        sys.exit(2)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        if module.rstrip() == " site":
+            # everything up to here is interpreter startup, not the wrapper
+            imports = []
+            continue
+        imports.append((int(self_us), int(cumulative_us), module.rstrip()))
+    return imports
+
+def total_ms(imports:list[tuple[int,int,str]]) -> float:
+    return sum(self_us for self_us, _, _ in imports) / 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup import budget check")
+    parser.add_argument("--budget-ratio", type=float, default=5, help="Maximum import time of the wrapper as a multiple of the stdlib reference")
+    parser.add_argument("--budget-ms", type=float, default=None, help="Absolute maximum import time of the wrapper, replaces --budget-ratio")
+    parser.add_argument("--runs", type=int, default=3, help="Measurements of the wrapper and the reference, the fastest ones are compared")
+    parser.add_argument("--forbid", type=str, default="duckdb,jwt,aiofiles", help="Comma separated modules that must not be imported on startup")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to print")
+    args = parser.parse_args()
+
+    imports = min((measure(wrapper_imports()) for _ in range(args.runs)), key=total_ms)
+    wrapper_ms = total_ms(imports)
+    if args.budget_ms is not None:
+        budget_ms = args.budget_ms
+        print(f"Wrapper startup imports: {wrapper_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+    else:
+        reference_ms = min(total_ms(measure(REFERENCE_IMPORTS)) for _ in range(args.runs))
+        budget_ms = args.budget_ratio * reference_ms
+        print(f"Wrapper startup imports: {wrapper_ms:.1f} ms (budget {budget_ms:.0f} ms, {args.budget_ratio:g}x the {reference_ms:.1f} ms stdlib reference)")
+    for self_us, cumulative_us, module in sorted(imports, key=lambda i: i[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {module.strip()}")
+
+    failed = False
+    imported = {module.strip() for _, _, module in imports}
+    for module in filter(None, args.forbid.split(",")):
+        if module in imported:
+            print(f"FAIL: {module} is imported on startup but should only load when needed")
+            failed = True
+    if wrapper_ms > budget_ms:
+        print(f"FAIL: startup imports take {wrapper_ms:.1f} ms, budget is {budget_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
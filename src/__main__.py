@@ -2,15 +2,23 @@
 import tasks.get_dependencies  # noqa: F401
 import subprocess
 import config
+import background
+import launch_state
+from pipeline import Pipeline
+import store
+import tracing
 from networking import api
+from networking.scheduler import get_scheduler
 from tasks import jars
 import logging
 import asyncio
 import os
 import sys
+import shutil
 from shutil import which
 import tasks.get_token as get_token
 import tasks.get_assets as get_assets
+from modpack import DataManager, validate
 
 # if you want to debug the modrinth app
 # handlers={
@@ -18,6 +26,8 @@ import tasks.get_assets as get_assets
 #     logging.StreamHandler()
 # }                                                                                                                  put it here
 logging.basicConfig(level=logging.INFO,format='[%(asctime)s] [%(name)s/%(levelname)s] %(message)s',datefmt='%H:%M:%S')
+# httpx logs every single request on info
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
 logger = logging.getLogger("NRC Wrapper")
 
@@ -26,93 +36,113 @@ logger = logging.getLogger("NRC Wrapper")
 # Wrapper script for the NoRisk Client.
 # This script adds the -D property, downloads assets, mods and then runs the game start command.
 
-os.makedirs(config.NRC_MOD_PATH,exist_ok=True)
-
-class ModLoader():
-    def __init__(self,loader_type,version):
-        self.type = loader_type
-        self.version = version
-
-class DataManager():
-    def __init__(self, data):
-        self.data = data
-        self.mods = []
-        self.assetpacks = []
-        self.repos = self.data.get("repositories")
-        self.compatible_versions = []
-        self.loader:ModLoader = None
-        self.pack = self.data.get("packs").get(config.NORISK_PACK)
-        
-
-        packs = []
-        def process(pack):
-            if not self.loader and pack.get("loaderPolicy").get("default").get("fabric").get("version"):
-                self.loader = ModLoader("fabric",pack.get("loaderPolicy").get("default").get("fabric").get("version"))
-            if pack.get("assets"):
-                self.assetpacks.extend(pack.get("assets"))
-            if pack.get("mods"):
-                self.mods.extend(pack.get("mods"))
-            if pack.get("inheritsFrom"):
-                for p in pack.get("inheritsFrom"):
-                    if p not in packs:
-                        packs.append(p)
-                        process(self.data.get("packs").get(p))
-        
-        process(self.pack)
-        self.assetpacks = list(set(self.assetpacks))
-        filtered_mods = []
-        filtered_ids = []
-        for m in self.mods:
-            if m.get("id") in filtered_ids:
-                continue
-            else:
-                self.compatible_versions.extend(m.get("compatibility"))
-                filtered_ids.append(m.get("id"))
-                filtered_mods.append(m)
-        self.mods = filtered_mods
-        self.compatible_versions = list(set(self.compatible_versions))
-        
-
-
-ASSET_PATH = "NoRiskClient/assets"
-
-async def validate(data:DataManager):
-    if config.MINECRAFT_VERSION in data.compatible_versions:
-        if data.loader:
-            if data.loader.type == config.LOADER:
-                if not data.loader.version == config.LOADER_VERSION:
-                    logger.warning(f"You are using a version of the modloader that isnt recommended. The recommended loader version is \"{data.loader.version}\" but the wrong version is present \"{config.LOADER_VERSION}\"!!")
-            else:
-                logger.error(f"Pack \"{data.pack.get("displayName")}\" isnt compatible with \"{config.LOADER}\"\nPlease Install \"{data.loader.type}\" version:\"{data.loader.version}\"")
-                sys.exit(1)
-    else:
-        logger.error(f"Pack \"{data.pack.get("displayName")}\" isnt compatible with \"{config.MINECRAFT_VERSION}\"\nAvalible versions for this pack: {data.compatible_versions}")
-        sys.exit(1)
-
-
-async def download_data():
-    modpacks = await api.get_norisk_modpacks()
+async def load_pack(modpacks:dict) -> DataManager:
     if config.NORISK_PACK not in modpacks.get("packs"):
         logger.error(f"{config.NORISK_PACK} isnt a valid modpack id. Valid ids are: {list(modpacks.get("packs").keys())}")
         sys.exit(1)
-    data = DataManager(modpacks)
+    data = DataManager(modpacks, api.cached_modpacks_hash())
     await validate(data)
-    tasks =[
-        get_assets.run(data.assetpacks),
-        jars.main(data.mods,data.repos),
-        get_token.main()
-
-    ]
-    results = await asyncio.gather(*tasks)
-    for result in results:
-        if result is not None:
-            return result
-
+    return data
+
+async def download_data(background_sync:bool = False):
+    '''
+    Syncs the mods and assets of the pack, builds the cosmetics overlay and gets the norisk token
+
+    Every step starts as soon as what it needs is there: auth doesnt wait for the pack,
+    the overlay only waits for the cosmetics assets, not for the mods or the other assets.
+
+    Args:
+        background_sync: only prepares the next launch, no token, no overlay and no asset gc
+            since the game is running, the mods go to the staging copy
+    '''
+    pipeline = Pipeline()
+    pipeline.add("modpacks", lambda r: api.get_norisk_modpacks())
+    pipeline.add("datamanager", lambda r: load_pack(r["modpacks"]), ["modpacks"])
+    pipeline.add("asset check", lambda r: get_assets.prepare(r["datamanager"].assetpacks, not background_sync), ["datamanager"])
+    pipeline.add("cosmetics", lambda r: get_assets.download([a for a in r["asset check"] if get_assets.is_cosmetic(a)], "cosmetics"), ["asset check"])
+    pipeline.add("assets", lambda r: get_assets.download([a for a in r["asset check"] if not get_assets.is_cosmetic(a)]), ["asset check"])
+    pipeline.add("mods", lambda r: jars.main(r["datamanager"].mods, r["datamanager"].repos), ["datamanager"])
+    if not background_sync:
+        pipeline.add("overlay", lambda r: get_assets.build_overlay(), ["cosmetics"])
+        pipeline.add("auth", lambda r: get_token.main())
+    try:
+        results = await pipeline.run()
+        if not background_sync:
+            launch_state.record(jars.all_downloaded, api.cached_modpacks_hash())
+        get_scheduler().log_summary()
+        content_store = store.get_store()
+        if content_store:
+            content_store.finish()
+    finally:
+        await api.close_client()
+    return results.get("auth")
+
+async def get_token_only():
+    '''
+    Fast launch: only the token is needed before the game can start
+    '''
+    try:
+        with tracing.span("auth"):
+            return await get_token.main()
+    finally:
+        await api.close_client()
+
+def sync_in_background():
+    '''
+    Entry point of the detached "sync" process of a fast launch, prepares the next launch
+
+    The game is loading the installed mods meanwhile, so the sync works on a staging copy
+    that the next launch moves into place before it starts the game.
+    '''
+    lock = launch_state.staging_lock()
+    if not lock.try_acquire():
+        logger.info("Another background sync is running")
+        return
+    try:
+        mod_path = config.NRC_MOD_PATH
+        staged = launch_state.prepare_staging()
+        config.NRC_MOD_PATH = str(staged / "mods")
+        try:
+            asyncio.run(download_data(background_sync=True))
+        except BaseException:
+            shutil.rmtree(staged, ignore_errors=True)
+            # the installed mods werent updated, the next launch syncs before starting
+            launch_state.invalidate()
+            raise
+        launch_state.record(jars.all_downloaded, api.cached_modpacks_hash(), mod_path, staged / launch_state.STATE_PATH)
+    finally:
+        lock.release()
+    logger.info("Background sync finished, the next launch uses it")
 
 
 def main():
-    token = asyncio.run(download_data())
-    asyncio.run(get_assets.injectIntoJar())
+    if background.current_task() == "refresh-token":
+        asyncio.run(get_token.refresh_in_background())
+        return
+    if background.current_task() == "sync":
+        sync_in_background()
+        return
+    if config.unknown_args[:1] == ["serve"]:
+        from networking import mirror
+        mirror.serve()
+        return
+    os.makedirs(config.NRC_MOD_PATH,exist_ok=True)
+    launch_state.apply_staged()
+    fast_launch = False
+    if config.FAST_LAUNCH:
+        reason = launch_state.stale_reason()
+        fast_launch = reason is None
+        if not fast_launch:
+            logger.info(f"Syncing before the launch, {reason}")
+    if fast_launch:
+        logger.info("Starting with the installed mods and assets, the pack gets synced in the background")
+        token = asyncio.run(get_token_only())
+        with tracing.span("overlay"):
+            asyncio.run(get_assets.build_overlay())
+        background.spawn("sync")
+    else:
+        token = asyncio.run(download_data())
+    tracing.finish()
 
     # Get the original command arguments
     original_args = config.unknown_args
@@ -124,7 +154,10 @@ def main():
 
     new_cmd.append(original_args[0])
     new_cmd.append(f"-Dnorisk.token={token}")
-    new_cmd.append(f"-Dfabric.addMods={config.NRC_MOD_PATH}")
+    add_mods = [config.NRC_MOD_PATH]
+    if get_assets.overlay_path().is_file():
+        add_mods.append(str(get_assets.overlay_path()))
+    new_cmd.append(f"-Dfabric.addMods={os.pathsep.join(add_mods)}")
     new_cmd.extend(original_args[1:])
 
 
@@ -0,0 +1,45 @@
+import logging
+import os
+import subprocess
+import sys
+import config
+
+logger = logging.getLogger("Background")
+
+# set in the environment of a detached wrapper process to tell it which task to run instead of launching the game
+TASK_ENV = "NRC_BACKGROUND_TASK"
+
+
+def current_task() -> str | None:
+    '''
+    Returns:
+        the background task this process was spawned for or None if it is a normal launch
+    '''
+    return os.environ.get(TASK_ENV)
+
+def spawn(task:str):
+    '''
+    Starts a detached copy of the wrapper (same arguments, same working dir) that runs task and exits,
+    it keeps running after the game replaced this process
+    '''
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    env = dict(os.environ)
+    env[TASK_ENV] = task
+    kwargs = {}
+    if sys.platform == "win32":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        with open(f"{config.CACHE_DIR}/background.log", "a") as log:
+            subprocess.Popen(
+                [sys.executable, *sys.argv],
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                **kwargs
+            )
+        logger.info(f"Started background task {task}")
+    except OSError as e:
+        logger.warning(f"Failed to start background task {task}: {e}")
@@ -4,7 +4,6 @@ import json
 import os
 from pathlib import Path
 import logging
-import duckdb
 
 def get_instance_data()-> tuple[str,str,str]:
     '''
@@ -43,6 +42,7 @@ def get_instance_data()-> tuple[str,str,str]:
         return "1.21.10" , "fabric", "0.17.3"
     else:
         try:
+            import duckdb
             data = duckdb.connect(f"{DATA_DIR}/app.db",read_only=True)
             current_dir_name = Path(os.getcwd()).name
             result = data.sql(f"SELECT mod_loader, mod_loader_version, game_version FROM profiles WHERE path = '{current_dir_name}'").fetchall()
@@ -65,6 +65,28 @@ parser.add_argument("-p","--norisk-pack",type=str,help="Norisk pack to use:\n Av
 parser.add_argument("-m","--mc-version", type=str,help="Overrides the automatic minecraft version detection")
 parser.add_argument("-n","--nrc-mod-path", type=str,help="The path where the norisk client mods will be installed")
 parser.add_argument("-nv", "--no-hash-verification", action='store_true',help="Prevents crashes if the file hashes are mismatched (workaround for api bugs)",default=False)
+parser.add_argument("--cache-dir", type=str,help="Directory for the wrappers caches")
+parser.add_argument("--store-path", type=str,help="Path to a content store shared by all instances, disabled if not set")
+parser.add_argument("--store-gc-days", type=float,help="Days an unreferenced file is kept in the content store")
+parser.add_argument("--fsync", choices=["never","jars","always"],help="Which downloads are fsynced before they are moved into place")
+parser.add_argument("--hash-workers", type=int,help="Number of threads used to hash files")
+parser.add_argument("--token-refresh-margin", type=float,help="Seconds before expiry at which the norisk token gets refreshed in the background")
+parser.add_argument("--download-retries", type=int,help="Attempts per file before a download fails")
+parser.add_argument("--download-deadline", type=float,help="Seconds a single file may take to download, including retries")
+parser.add_argument("--cdn-transport", choices=["http1","http2"],help="Http version used for the norisk asset cdn")
+parser.add_argument("--max-concurrency", type=int,help="Upper limit for parallel downloads per host")
+parser.add_argument("--initial-concurrency", type=int,help="Parallel downloads per host to start with before adapting")
+parser.add_argument("--mirror", type=str,help="Url of a LAN mirror (nrc-wrapper serve) that is tried before the upstream servers")
+parser.add_argument("--mirror-ttl", type=float,help="Seconds the mirror serves norisk api responses before revalidating them")
+parser.add_argument("--serve-host", type=str,help="Address the mirror listens on")
+parser.add_argument("--serve-port", type=int,help="Port the mirror listens on")
+parser.add_argument("--trace", type=str,help="Writes a chrome trace of the launch phases and downloads to this file")
+parser.add_argument("--fast-launch", action='store_true',help="Starts the game with the last synced mods and assets and syncs the pack in the background for the next launch",default=False)
+parser.add_argument("--asset-gc", choices=["off","quarantine","delete"],help="What happens to assets that no manifest references anymore")
+parser.add_argument("--modpacks-deadline", type=float,help="Seconds to wait for the norisk api before using the cached modpacks")
+parser.add_argument("--max-connections", type=int,help="Maximum number of open http connections")
+parser.add_argument("--max-connections-per-host", type=int,help="Maximum number of open http connections to a single norisk/modrinth/mojang host")
+parser.add_argument("--keepalive-expiry", type=float,help="Seconds an idle http connection is kept open for reuse")
 args, unknown_args = parser.parse_known_args()
 
 LAUNCHER = (
@@ -78,13 +100,124 @@ NO_HASH_VERIFICATION = (
     False
 )
 
+STORE_PATH = (
+    args.store_path or
+    os.environ.get("NRC_STORE_PATH") or
+    None
+)
+STORE_GC_DAYS = float(
+    args.store_gc_days or
+    os.environ.get("NRC_STORE_GC_DAYS") or
+    14
+)
+FSYNC = (
+    args.fsync or
+    os.environ.get("NRC_FSYNC") or
+    "jars"
+)
+HASH_WORKERS = int(
+    args.hash_workers or
+    os.environ.get("NRC_HASH_WORKERS") or
+    os.cpu_count() or
+    4
+)
+TOKEN_REFRESH_MARGIN = float(
+    args.token_refresh_margin or
+    os.environ.get("NRC_TOKEN_REFRESH_MARGIN") or
+    6 * 60 * 60
+)
+DOWNLOAD_RETRIES = int(
+    args.download_retries or
+    os.environ.get("NRC_DOWNLOAD_RETRIES") or
+    4
+)
+DOWNLOAD_DEADLINE = float(
+    args.download_deadline or
+    os.environ.get("NRC_DOWNLOAD_DEADLINE") or
+    300
+)
+CDN_TRANSPORT = (
+    args.cdn_transport or
+    os.environ.get("NRC_CDN_TRANSPORT") or
+    "http2"
+)
+MAX_CONCURRENCY = int(
+    args.max_concurrency or
+    os.environ.get("NRC_MAX_CONCURRENCY") or
+    64
+)
+INITIAL_CONCURRENCY = int(
+    args.initial_concurrency or
+    os.environ.get("NRC_INITIAL_CONCURRENCY") or
+    8
+)
+MIRROR_URL = (
+    args.mirror or
+    os.environ.get("NRC_MIRROR") or
+    None
+)
+MIRROR_TTL = float(
+    args.mirror_ttl or
+    os.environ.get("NRC_MIRROR_TTL") or
+    60
+)
+SERVE_HOST = (
+    args.serve_host or
+    os.environ.get("NRC_SERVE_HOST") or
+    "0.0.0.0"
+)
+SERVE_PORT = int(
+    args.serve_port or
+    os.environ.get("NRC_SERVE_PORT") or
+    8800
+)
+TRACE_PATH = (
+    args.trace or
+    os.environ.get("NRC_TRACE") or
+    None
+)
+FAST_LAUNCH = (
+    args.fast_launch or
+    bool(os.environ.get("NRC_FAST_LAUNCH")) or
+    False
+)
+ASSET_GC = (
+    args.asset_gc or
+    os.environ.get("NRC_ASSET_GC") or
+    "quarantine"
+)
+MODPACKS_DEADLINE = float(
+    args.modpacks_deadline or
+    os.environ.get("NRC_MODPACKS_DEADLINE") or
+    5
+)
+MAX_CONNECTIONS = int(
+    args.max_connections or
+    os.environ.get("NRC_MAX_CONNECTIONS") or
+    50
+)
+MAX_CONNECTIONS_PER_HOST = int(
+    args.max_connections_per_host or
+    os.environ.get("NRC_MAX_CONNECTIONS_PER_HOST") or
+    20
+)
+KEEPALIVE_EXPIRY = float(
+    args.keepalive_expiry or
+    os.environ.get("NRC_KEEPALIVE_EXPIRY") or
+    30
+)
+
 NRC_MOD_PATH = (
     args.nrc_mod_path or                    
     os.environ.get("NRC_MOD_PATH") or
     "./mods/NoriskClient"
 )
 
-os.makedirs(NRC_MOD_PATH,exist_ok=True)
+CACHE_DIR = (
+    args.cache_dir or
+    os.environ.get("NRC_CACHE_DIR") or
+    "./.nrc-cache"
+)
 
 MODRINTH_DATA_DIR = (
     args.modrinth_data_path or          
@@ -117,7 +250,20 @@ elif LAUNCHER == "prism":
 else:
     raise Exception("Invalid Launcher type")
 
-MINECRAFT_VERSION, LOADER, LOADER_VERSION = get_instance_data()
+_instance_data: dict = None
 
-if args.mc_version is not None:
-    MINECRAFT_VERSION = args.mc_version
\ No newline at end of file
+def __getattr__(name):
+    '''
+    MINECRAFT_VERSION, LOADER and LOADER_VERSION are only read from the instance the first time they are used
+    '''
+    global _instance_data
+    if name in ("MINECRAFT_VERSION", "LOADER", "LOADER_VERSION"):
+        if _instance_data is None:
+            minecraft_version, loader, loader_version = get_instance_data()
+            _instance_data = {
+                "MINECRAFT_VERSION": args.mc_version or minecraft_version,
+                "LOADER": loader,
+                "LOADER_VERSION": loader_version
+            }
+        return _instance_data[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import sys
+import time
+
+# backoff while waiting for another process, locks are polled so waiting never blocks the event loop
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+
+
+if sys.platform == "win32":
+    import msvcrt
+
+    def _lock(fd):
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    def _unlock(fd):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _lock(fd):
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileLock():
+    '''
+    Advisory lock shared between processes (flock on posix, msvcrt.locking on windows),
+    the os drops it when the holder dies so a crashed launcher never leaves it taken
+
+    Use it with "with" in sync code and "async with" in async code.
+    contended is set if another process held the lock while this one waited.
+    '''
+    def __init__(self, path, remove:bool = False, timeout:float = None):
+        '''
+        Args:
+            path: lock file, created if missing
+            remove: delete the lock file on release, for locks on files that come and go
+            timeout: seconds to wait before raising TimeoutError, None waits forever
+        '''
+        self.path = str(path)
+        self.remove = remove
+        self.timeout = timeout
+        self.fd = None
+        self.contended = False
+
+    def try_acquire(self) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock(fd)
+        except OSError:
+            os.close(fd)
+            return False
+        # a holder with remove=True might have deleted the file between open and lock
+        try:
+            current = os.path.samestat(os.fstat(fd), os.stat(self.path))
+        except FileNotFoundError:
+            current = False
+        if not current:
+            _unlock(fd)
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def waits(self):
+        '''
+        Yields the time to sleep until the lock is taken, raises TimeoutError after timeout
+        '''
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        interval = POLL_INTERVAL
+        while not self.try_acquire():
+            self.contended = True
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{self.path} is held by another process")
+            yield interval
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def acquire(self):
+        for interval in self.waits():
+            time.sleep(interval)
+
+    async def acquire_async(self):
+        for interval in self.waits():
+            await asyncio.sleep(interval)
+
+    def release(self):
+        if self.fd is None:
+            return
+        if self.remove:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                # windows cant delete open files, the next holder reuses it
+                pass
+        _unlock(self.fd)
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+        return False
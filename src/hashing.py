@@ -0,0 +1,167 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+import stat
+import time
+from pathlib import Path
+import config
+
+CHUNK_SIZE = 1024 * 1024
+CACHE_VERSION = 1
+# a file written this close to the cache lookup can still change without its
+# mtime moving (coarse fs timestamps), so its hash is never cached
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def md5_file(file) -> str:
+    '''
+    Calculates the md5 hash for given path, reading it in chunks
+
+    Args:
+        file: path to a file
+    '''
+    h = hashlib.md5()
+    with open(file,'rb') as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+_executor: ThreadPoolExecutor | None = None
+
+def get_executor() -> ThreadPoolExecutor:
+    '''
+    Returns the thread pool used for hashing, hashlib releases the GIL so this scales over all cores
+    '''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=config.HASH_WORKERS, thread_name_prefix="hasher")
+    return _executor
+
+async def calc_hash(file) -> str:
+    '''
+    Calculates the md5 hash for given path without blocking the event loop
+
+    Args:
+        file: path to a file
+    '''
+    return await asyncio.get_running_loop().run_in_executor(get_executor(), md5_file, file)
+
+class HashCache():
+    '''
+    On disk cache of file hashes
+
+    Entries are keyed by path and only trusted while size, mtime_ns and inode
+    of the file still match, so a rewritten file is always hashed again.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries: dict[str, list] = None
+        self.seen = set()
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.entries = data.get("files")
+            else:
+                self.entries = {}
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def save(self, prune=False):
+        '''
+        Writes the cache to disk
+
+        Args:
+            prune: drop every entry that wasnt looked up during this run
+        '''
+        if self.entries is None:
+            return
+        if prune and len(self.seen) != len(self.entries):
+            self.entries = {k: v for k, v in self.entries.items() if k in self.seen}
+            self.dirty = True
+        if not self.dirty:
+            return
+        os.makedirs(self.path.parent, exist_ok=True)
+        # per process, launchers sharing the cache dir save at the same time
+        temp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "files": self.entries}, f)
+        os.replace(temp_path, self.path)
+        self.dirty = False
+
+    def lookup(self, file, st:os.stat_result) -> str | None:
+        '''
+        Returns the cached hash for file if its stat info didnt change
+        '''
+        if self.entries is None:
+            self.load()
+        key = os.path.normpath(file)
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        if entry and entry[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+            return entry[3]
+        return None
+
+    def store(self, file, digest:str, st:os.stat_result):
+        if self.entries is None:
+            self.load()
+        key = os.path.normpath(file)
+        self.seen.add(key)
+        if time.time_ns() - st.st_mtime_ns < RACY_WINDOW_NS:
+            if self.entries.pop(key, None) is not None:
+                self.dirty = True
+            return
+        self.entries[key] = [st.st_size, st.st_mtime_ns, st.st_ino, digest]
+        self.dirty = True
+
+    def stat(self, file) -> os.stat_result | None:
+        try:
+            st = os.stat(file)
+        except FileNotFoundError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st
+
+    async def get_hash(self, file) -> str | None:
+        '''
+        Returns the md5 hash of file, only reading it if it changed since it was last hashed
+
+        Returns:
+            hash:str or None if the file doesnt exist
+        '''
+        return (await self.get_hashes([file]))[0]
+
+    async def get_hashes(self, files:list) -> list[str | None]:
+        '''
+        Batch version of get_hash, every file that has to be read is hashed in parallel
+
+        Returns:
+            list of hashes in the same order as files, None for files that dont exist
+        '''
+        results = []
+        misses = []
+        for i, file in enumerate(files):
+            st = self.stat(file)
+            digest = None
+            if st is not None:
+                digest = self.lookup(file, st)
+                if digest is None:
+                    misses.append((i, file, st))
+            results.append(digest)
+
+        digests = await asyncio.gather(*(calc_hash(file) for _, file, _ in misses), return_exceptions=True)
+        for (i, file, st), digest in zip(misses, digests):
+            if isinstance(digest, OSError):
+                # removed while we were hashing
+                continue
+            if isinstance(digest, BaseException):
+                raise digest
+            self.store(file, digest, st)
+            results[i] = digest
+        return results
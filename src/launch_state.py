@@ -0,0 +1,197 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+import config
+import filelock
+
+logger = logging.getLogger("Launch State")
+
+STATE_PATH = ".nrc-launch.json"
+# fast launches fall back to a blocking sync if the background syncs kept failing for this long
+MAX_AGE = 7 * 24 * 60 * 60
+
+
+def read(path = STATE_PATH) -> dict | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write(state:dict, path = STATE_PATH):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, path)
+
+def record(complete:bool, modpacks_hash:str = None, mod_path:str = None, path = STATE_PATH):
+    '''
+    Records which pack the installed mods and assets belong to, after a sync
+
+    Args:
+        complete: every mod and asset was downloaded and verified
+        modpacks_hash: md5 of the modpacks-v3 response the sync used
+        mod_path: where the mods end up, NRC_MOD_PATH if not set
+        path: state file, the background sync writes the one of its staging copy
+    '''
+    write({
+        "complete": complete,
+        "pack": config.NORISK_PACK,
+        "minecraft_version": config.MINECRAFT_VERSION,
+        "loader": config.LOADER,
+        "mod_path": mod_path or config.NRC_MOD_PATH,
+        "modpacks_hash": modpacks_hash,
+        "synced": time.time()
+    }, path)
+
+def invalidate():
+    '''
+    Makes the next launch sync before starting the game
+    '''
+    state = read()
+    if state and state.get("complete"):
+        state["complete"] = False
+        write(state)
+
+def staging_path() -> Path:
+    '''
+    Returns:
+        where the background sync keeps the mods and index for the next launch
+    '''
+    return Path(config.CACHE_DIR) / "staged"
+
+def staging_lock() -> filelock.FileLock:
+    '''
+    Held by the background sync while it works on the staging copy
+    '''
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    return filelock.FileLock(f"{config.CACHE_DIR}/staged.lock")
+
+def mod_files(path) -> list[os.DirEntry]:
+    return [entry for entry in os.scandir(path) if entry.is_file() and entry.name.endswith((".jar", ".jar.disabled"))]
+
+def prepare_staging() -> Path:
+    '''
+    Copies the installed mods and index into the staging dir, the background sync updates that copy
+    while the game loads the installed mods. Jars are hardlinked, on windows they are copied
+    since a link of a jar the game has open cant be deleted there.
+    '''
+    from tasks import jars
+    staged = staging_path()
+    shutil.rmtree(staged, ignore_errors=True)
+    os.makedirs(staged / "mods")
+    # a launcher syncing the installed mods right now finishes first
+    with jars.index_lock():
+        for entry in mod_files(config.NRC_MOD_PATH):
+            target = staged / "mods" / entry.name
+            try:
+                if sys.platform == "win32":
+                    raise OSError("no hardlinks on windows")
+                os.link(entry.path, target)
+            except OSError:
+                shutil.copy2(entry.path, target)
+        index = jars.load_index()
+    if index is not None:
+        with open(staged / "mods" / jars.INDEX_NAME, "w") as f:
+            json.dump(index, f, indent=2)
+    return staged
+
+def apply_staged():
+    '''
+    Moves the mods of the last background sync into place, has to run before the game starts.
+    A sync that is still running is left alone and the installed mods are used,
+    one that failed or was for another pack or version makes this launch sync before starting.
+    '''
+    from tasks import jars
+    staged = staging_path()
+    if not staged.is_dir():
+        return
+    lock = staging_lock()
+    if not lock.try_acquire():
+        logger.info("The background sync is still running, starting with the installed mods")
+        return
+    try:
+        state = read(staged / STATE_PATH)
+        if (
+            state and state.get("complete") and
+            state.get("pack") == config.NORISK_PACK and
+            state.get("mod_path") == config.NRC_MOD_PATH and
+            state.get("minecraft_version") == config.MINECRAFT_VERSION and
+            state.get("loader") == config.LOADER
+        ):
+            # other instances using the mod dir dont sync while the mods are swapped
+            with jars.index_lock():
+                swap_staged(staged, state)
+        else:
+            invalidate()
+        shutil.rmtree(staged, ignore_errors=True)
+    finally:
+        lock.release()
+
+def read_index(path) -> list | None:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def swap_staged(staged:Path, state:dict):
+    from tasks import jars
+    new_index = read_index(staged / "mods" / jars.INDEX_NAME)
+    if new_index is None:
+        return
+    old_index = jars.load_index() or []
+    # a crash halfway leaves a mix of both, the next launch then syncs before starting
+    invalidate()
+    try:
+        keep = {entry.get("filename") for entry in new_index}
+        for name in keep:
+            os.replace(staged / "mods" / name, f"{config.NRC_MOD_PATH}/{name}")
+        for entry in old_index:
+            if entry.get("filename") not in keep:
+                Path(f"{config.NRC_MOD_PATH}/{entry.get('filename')}").unlink(missing_ok=True)
+        os.replace(staged / "mods" / jars.INDEX_NAME, jars.index_path())
+    except OSError as e:
+        logger.warning(f"Failed to apply the background sync, syncing again: {e}")
+        return
+    write(state)
+    logger.info("Applied the mods of the last background sync")
+
+def stale_reason() -> str | None:
+    '''
+    Checks if the game can start with the installed mods and assets right away
+
+    Returns:
+        why a blocking sync is needed or None if the last sync can be used
+    '''
+    state = read()
+    if state is None:
+        return "there was no sync yet"
+    if not state.get("complete"):
+        return "the last sync didnt finish"
+    if time.time() - state.get("synced", 0) > MAX_AGE:
+        return "the last sync is too old"
+    if state.get("pack") != config.NORISK_PACK:
+        return "the pack changed"
+    if state.get("mod_path") != config.NRC_MOD_PATH:
+        return "the mod path changed"
+    if state.get("minecraft_version") != config.MINECRAFT_VERSION or state.get("loader") != config.LOADER:
+        return "the minecraft version or loader of the instance changed"
+    from tasks import jars
+    index = jars.load_index()
+    if index is None:
+        return "the mod index is missing"
+    for entry in index:
+        if entry.get("id") == jars.CORE_MOD_ID and entry.get("format", 1) < jars.INDEX_FORMAT:
+            return "nrc-core may still have the cosmetics injected"
+        try:
+            st = os.stat(f"{config.NRC_MOD_PATH}/{entry.get('filename')}")
+        except (OSError, TypeError):
+            return f"{entry.get('id')} is missing"
+        if st.st_size != entry.get("size") or st.st_mtime_ns != entry.get("mtime_ns"):
+            return f"{entry.get('id')} changed on disk"
+    return None
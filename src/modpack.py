@@ -0,0 +1,121 @@
+import json
+import logging
+import os
+import sys
+import config
+
+logger = logging.getLogger("NRC Wrapper")
+
+
+class ModLoader():
+    def __init__(self,loader_type,version):
+        self.type = loader_type
+        self.version = version
+
+# bump when the layout of the resolved pack cache changes
+RESOLVED_VERSION = 1
+
+
+def resolve_pack(packs:dict, pack_id:str) -> dict:
+    '''
+    Resolves a pack and everything it inherits from
+
+    Override order: the pack itself comes first, then its inheritsFrom entries in order,
+    each followed by its own parents (depth first). The first mod with an id wins, the
+    first pack with a fabric version sets the loader. Every pack is visited once.
+
+    Returns:
+        {"loader": version or None, "assetpacks": [...], "mods": [[pack id, index in its mods], ...], "compatible_versions": [...]}
+    '''
+    order = []
+    seen = {pack_id}
+    def visit(current_id):
+        order.append(current_id)
+        for parent in packs.get(current_id).get("inheritsFrom") or []:
+            if parent not in seen:
+                seen.add(parent)
+                visit(parent)
+    visit(pack_id)
+
+    loader = None
+    assetpacks = {}
+    mods = {}
+    compatible_versions = set()
+    for current_id in order:
+        pack = packs.get(current_id)
+        if loader is None:
+            loader = (((pack.get("loaderPolicy") or {}).get("default") or {}).get("fabric") or {}).get("version")
+        for asset in pack.get("assets") or []:
+            assetpacks.setdefault(asset, None)
+        for i, mod in enumerate(pack.get("mods") or []):
+            if mod.get("id") not in mods:
+                mods[mod.get("id")] = [current_id, i]
+                compatible_versions.update(mod.get("compatibility"))
+    return {
+        "loader": loader,
+        "assetpacks": list(assetpacks),
+        "mods": list(mods.values()),
+        "compatible_versions": sorted(compatible_versions)
+    }
+
+def read_resolved(key:str) -> dict | None:
+    try:
+        with open(f"{config.CACHE_DIR}/resolved-pack.json") as f:
+            cached = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if cached.get("version") != RESOLVED_VERSION or cached.get("key") != key:
+        return None
+    return cached.get("pack")
+
+def write_resolved(key:str, resolved:dict):
+    try:
+        os.makedirs(config.CACHE_DIR, exist_ok=True)
+        temp_path = f"{config.CACHE_DIR}/resolved-pack.json.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": RESOLVED_VERSION, "key": key, "pack": resolved}, f)
+        os.replace(temp_path, f"{config.CACHE_DIR}/resolved-pack.json")
+    except OSError as e:
+        logger.warning(f"Failed to cache the resolved pack: {e}")
+
+class DataManager():
+    '''
+    Mods, assets and loader of NORISK_PACK with everything it inherits resolved
+
+    Args:
+        data: modpacks-v3 response
+        content_hash: md5 of the raw response, the resolved pack is cached on disk when given
+    '''
+    def __init__(self, data, content_hash:str = None):
+        self.data = data
+        self.repos = self.data.get("repositories")
+        self.pack = self.data.get("packs").get(config.NORISK_PACK)
+
+        resolved = None
+        if content_hash:
+            key = f"{content_hash}:{config.NORISK_PACK}:{config.MINECRAFT_VERSION}"
+            resolved = read_resolved(key)
+        if resolved is None:
+            resolved = resolve_pack(self.data.get("packs"), config.NORISK_PACK)
+            if content_hash:
+                write_resolved(key, resolved)
+
+        packs = self.data.get("packs")
+        self.mods = [packs.get(pack_id).get("mods")[i] for pack_id, i in resolved["mods"]]
+        self.assetpacks = resolved["assetpacks"]
+        self.compatible_versions = resolved["compatible_versions"]
+        self.loader:ModLoader = ModLoader("fabric", resolved["loader"]) if resolved["loader"] else None
+
+
+async def validate(data:DataManager):
+    if config.MINECRAFT_VERSION in data.compatible_versions:
+        if data.loader:
+            if data.loader.type == config.LOADER:
+                if not data.loader.version == config.LOADER_VERSION:
+                    logger.warning(f"You are using a version of the modloader that isnt recommended. The recommended loader version is \"{data.loader.version}\" but the wrong version is present \"{config.LOADER_VERSION}\"!!")
+            else:
+                logger.error(f"Pack \"{data.pack.get("displayName")}\" isnt compatible with \"{config.LOADER}\"\nPlease Install \"{data.loader.type}\" version:\"{data.loader.version}\"")
+                sys.exit(1)
+    else:
+        logger.error(f"Pack \"{data.pack.get("displayName")}\" isnt compatible with \"{config.MINECRAFT_VERSION}\"\nAvalible versions for this pack: {data.compatible_versions}")
+        sys.exit(1)
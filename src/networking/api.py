@@ -1,16 +1,22 @@
 import asyncio
+from collections import Counter
 import hashlib
+import importlib.util
+import json
 import logging
 import os
 from pathlib import Path
 import platform
 from typing import Dict
+from urllib.parse import urlsplit
 import uuid
-import aiofiles
-import aiohttp
 import httpx
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import AsyncRetrying, retry, retry_if_exception, stop_after_attempt, wait_exponential, wait_random_exponential
 import config
+import filelock
+import hashing
+import tracing
+from networking.scheduler import get_scheduler
 
 
 logger = logging.getLogger("Minecraft/Norisk API")
@@ -18,141 +24,437 @@ logger = logging.getLogger("Minecraft/Norisk API")
 ASSET_PATH = "NoRiskClient/assets"
 MOJANG_SESSION_URL = "https://sessionserver.mojang.com"
 NORISK_API_URL = "https://api.norisk.gg/api/v1"
-concurrent_downloads = 10
+CHUNK_SIZE = 64 * 1024
 
-async def download_jar(download_url,filename):
-    """Downloads jar file from given url"""
-    logger = logging.getLogger("Mod Downloader")
-    logger.info(f"Downloading {filename} [{download_url}]")
-    async with asyncio.Semaphore(concurrent_downloads):
+CDN_HOST = "cdn.norisk.gg"
+# md5 a download from the LAN mirror is expected to have, the mirror refetches cached bodies that dont match
+MIRROR_HASH_HEADER = "X-NRC-Expected-MD5"
+# hosts that get their own connection pool
+POOLED_HOSTS = [
+    "api.norisk.gg",
+    CDN_HOST,
+    "api.modrinth.com",
+    "sessionserver.mojang.com"
+]
+
+_client: httpx.AsyncClient | None = None
+# negotiated http version -> number of downloads, to compare the --cdn-transport modes
+http_versions = Counter()
+# set once the LAN mirror couldnt be reached, the rest of the run goes upstream directly
+_mirror_down = False
+
+def use_http2() -> bool:
+    '''
+    Whether the CDN connection should offer HTTP/2, the server can still fall back to HTTP/1.1
+    '''
+    if config.CDN_TRANSPORT != "http2":
+        return False
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("h2 isnt installed, using HTTP/1.1 for the CDN")
+        return False
+    return True
+
+def get_client() -> httpx.AsyncClient:
+    '''
+    Returns the shared http client, creates it on first use
+
+    Every known host gets its own connection pool so a busy CDN can't starve
+    the auth requests, connections are kept alive and reused for the whole run.
+    The CDN is spoken to over HTTP/2 so the small asset requests share a few multiplexed connections.
+    '''
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(
+            max_connections=config.MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=config.MAX_CONNECTIONS_PER_HOST,
+            keepalive_expiry=config.KEEPALIVE_EXPIRY
+        )
+        _client = httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=httpx.Timeout(30, connect=10),
+            limits=httpx.Limits(
+                max_connections=config.MAX_CONNECTIONS,
+                max_keepalive_connections=config.MAX_CONNECTIONS,
+                keepalive_expiry=config.KEEPALIVE_EXPIRY
+            ),
+            mounts={
+                f"https://{host}": httpx.AsyncHTTPTransport(limits=limits, http2=host == CDN_HOST and use_http2())
+                for host in POOLED_HOSTS
+            }
+        )
+    return _client
+
+async def close_client():
+    '''
+    Closes the shared http client and all pooled connections
+    '''
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def mirror_url(url:str) -> str | None:
+    '''
+    Returns:
+        where the LAN mirror serves url or None if no (working) mirror is configured
+    '''
+    if not config.MIRROR_URL or _mirror_down:
+        return None
+    parts = urlsplit(url)
+    if parts.scheme != "https":
+        return None
+    mirrored = f"{config.MIRROR_URL.rstrip('/')}/{parts.netloc}{parts.path}"
+    return f"{mirrored}?{parts.query}" if parts.query else mirrored
+
+def mirror_failed(e:BaseException):
+    '''
+    Stops using the mirror if it isnt reachable at all, other errors only affect a single file
+    '''
+    global _mirror_down
+    if isinstance(e, httpx.TransportError) and not _mirror_down:
+        _mirror_down = True
+        logger.warning(f"Mirror {config.MIRROR_URL} isnt reachable, using the upstream servers: {repr(e)}")
+
+async def get_mirrored(url:str, **kwargs) -> httpx.Response:
+    '''
+    GET request that asks the LAN mirror first and falls back to url itself
+    '''
+    mirrored = mirror_url(url)
+    if mirrored:
+        try:
+            response = await get_client().get(mirrored, **kwargs)
+            # 403 means the mirror doesnt serve this url, 5xx that it couldnt get it
+            if response.status_code < 500 and response.status_code != 403:
+                return response
+            logger.warning(f"Mirror couldnt deliver {url} ({response.status_code}), requesting it directly")
+        except httpx.TransportError as e:
+            mirror_failed(e)
+    return await get_client().get(url, **kwargs)
+
+class HashMismatchError(ValueError):
+    pass
+
+class StalePartError(Exception):
+    '''
+    A partial download couldnt be resumed and was discarded
+    '''
+    pass
+
+def is_retryable(e:BaseException) -> bool:
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return isinstance(e, (httpx.TransportError, HashMismatchError, StalePartError))
+
+def is_partial(path) -> bool:
+    '''
+    True for the .part and .lock files of unfinished downloads
+    '''
+    return str(path).endswith((".part", ".part.json", ".lock"))
+
+def discard_part(destination:str):
+    Path(f"{destination}.part").unlink(missing_ok=True)
+    Path(f"{destination}.part.json").unlink(missing_ok=True)
+
+def hash_existing_part(md5, part_path:str):
+    with open(part_path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            md5.update(chunk)
+
+def commit_file(temp_path:str, destination:str, fsync:bool):
+    '''
+    Atomically moves a finished download into place
+    '''
+    os.replace(temp_path, destination)
+    if fsync and os.name == "posix":
+        dir_fd = os.open(Path(destination).parent, os.O_RDONLY)
         try:
-            async with aiohttp.ClientSession() as client:
-                async with client.get(download_url) as response:
-                    response.raise_for_status()
-                    async with aiofiles.open(f"{config.NRC_MOD_PATH}/{filename}", 'wb') as f:
-                        async for chunk in response.content.iter_chunked(8192):
-                            await f.write(chunk)
-                        logger.info(f"Downloaded {filename} ✅")
-                        return True
-        except aiohttp.ClientResponseError as e:
-            if e.status == 404:
-                logger.error(f"file not found[404 error]: {download_url} ❌")
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+def start_deadline(deadline:asyncio.Timeout | None):
+    '''
+    Starts the DOWNLOAD_DEADLINE of a file once its first attempt got a scheduler slot,
+    time spent queued behind other downloads doesnt count against it
+    '''
+    if deadline is not None and deadline.when() is None:
+        deadline.reschedule(asyncio.get_running_loop().time() + config.DOWNLOAD_DEADLINE)
+
+async def fetch_to_file(url:str, destination:str, fsync:bool, target_hash:str = None, size:int = 0, deadline:asyncio.Timeout = None, mirrored:bool = False) -> str:
+    '''
+    One attempt at downloading url to destination
+
+    The body is streamed into destination.part while it is hashed, its validators are kept in
+    destination.part.json so an interrupted download continues with a Range request next time.
+    The file only appears at destination once it is complete and verified.
+
+    Args:
+        deadline: unstarted timeout of the whole download, started once the slot is there
+        mirrored: url points to the LAN mirror, it gets told which hash is expected
+
+    Returns:
+        md5 hash of the file
+    '''
+    import aiofiles
+    part_path = f"{destination}.part"
+    meta_path = f"{destination}.part.json"
+    headers = {}
+    if mirrored and target_hash:
+        headers[MIRROR_HASH_HEADER] = target_hash
+    offset = 0
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        meta = {}
+    validator = meta.get("etag") or meta.get("last_modified")
+    if meta.get("url") == url and validator and os.path.isfile(part_path):
+        offset = os.path.getsize(part_path)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = validator
+
+    async with get_scheduler().slot(url, max(size - offset, 0)) as slot:
+        start_deadline(deadline)
+        async with get_client().stream("GET", url, headers=headers) as response:
+            slot.first_byte()
+            tracing.annotate(status=response.status_code, http_version=response.http_version)
+            if response.status_code == 416:
+                discard_part(destination)
+                raise StalePartError(f"Couldnt resume {url}")
+            response.raise_for_status()
+            http_versions[response.http_version] += 1
+
+            md5 = hashlib.md5()
+            if response.status_code == 206:
+                if not response.headers.get("content-range", "").startswith(f"bytes {offset}-"):
+                    discard_part(destination)
+                    raise StalePartError(f"Unexpected range for {url}: {response.headers.get('content-range')}")
+                logger.info(f"Resuming {url} at {offset} bytes")
+                await asyncio.to_thread(hash_existing_part, md5, part_path)
+                mode = "ab"
             else:
-                logger.exception(f"HTTP error: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
+                mode = "wb"
+                if response.headers.get("etag") or response.headers.get("last-modified"):
+                    with open(meta_path, "w") as f:
+                        json.dump({
+                            "url": url,
+                            "etag": response.headers.get("etag"),
+                            "last_modified": response.headers.get("last-modified")
+                        }, f)
+                else:
+                    Path(meta_path).unlink(missing_ok=True)
+
+            async with aiofiles.open(part_path, mode) as f:
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    md5.update(chunk)
+                    slot.add_bytes(len(chunk))
+                    await f.write(chunk)
+                if fsync:
+                    await f.flush()
+                    await asyncio.to_thread(os.fsync, f.fileno())
+            tracing.annotate(bytes=slot.size, resumed_from=offset)
+
+    downloaded_hash = md5.hexdigest()
+    if target_hash is not None and downloaded_hash != target_hash:
+        if not config.NO_HASH_VERIFICATION:
+            discard_part(destination)
+            raise HashMismatchError(f"Hash mismatch for {destination}")
+        logger.warning(f"Hash mismatch for {destination}")
+
+    commit_file(part_path, destination, fsync)
+    Path(meta_path).unlink(missing_ok=True)
+    return downloaded_hash
+
+async def download(url:str, destination:str, fsync:bool, target_hash:str = None, size:int = 0) -> str:
+    '''
+    Downloads url to destination, retrying with jittered backoff and giving up DOWNLOAD_DEADLINE after it got its first slot.
+    If a LAN mirror is configured it gets one attempt first
+
+    Args:
+        size: expected bytes, larger downloads get a slot first
+
+    Returns:
+        md5 hash of the file
+    '''
+    def before_sleep(state):
+        logger.warning(f"Retrying {url} (attempt {state.attempt_number}): {repr(state.outcome.exception())}")
+        tracing.annotate(retries=state.attempt_number)
+
+    async def with_retries(deadline:asyncio.Timeout):
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(config.DOWNLOAD_RETRIES),
+            wait=wait_random_exponential(multiplier=1, max=30),
+            retry=retry_if_exception(is_retryable),
+            before_sleep=before_sleep,
+            reraise=True
+        )
+        async for attempt in retrying:
+            with attempt:
+                return await fetch_to_file(url, destination, fsync, target_hash, size, deadline)
+
+    # a second launcher sharing the destination waits for the first one instead of writing the same .part file
+    lock = filelock.FileLock(f"{destination}.lock", remove=True, timeout=config.DOWNLOAD_DEADLINE)
+    with tracing.span("download", "download", url=url) as span:
+        async with lock:
+            if lock.contended and os.path.isfile(destination):
+                digest = await hashing.calc_hash(destination)
+                if target_hash is None or digest == target_hash:
+                    logger.info(f"Another launcher downloaded {url}")
+                    span.set(source="other process")
+                    return digest
+
+            mirrored = mirror_url(url)
+            if mirrored:
+                try:
+                    async with asyncio.timeout(None) as deadline:
+                        digest = await fetch_to_file(mirrored, destination, fsync, target_hash, size, deadline, mirrored=True)
+                    span.set(source="mirror")
+                    return digest
+                except (httpx.HTTPError, HashMismatchError, StalePartError, asyncio.TimeoutError) as e:
+                    mirror_failed(e)
+                    logger.warning(f"Mirror couldnt deliver {url}, downloading it directly: {repr(e)}")
+
+            async with asyncio.timeout(None) as deadline:
+                return await with_retries(deadline)
+
+async def download_jar(download_url,filename,size:int = 0,target_hash:str = None) -> str | None:
+    """
+    Downloads jar file from given url
+
+    Args:
+        target_hash: md5 the jar has to have, None if it isnt known
+
+    Returns:
+        md5 hash of the jar or None if the download failed
+    """
+    logger = logging.getLogger("Mod Downloader")
+    logger.info(f"Downloading {filename} [{download_url}]")
+    destination = f"{config.NRC_MOD_PATH}/{filename}"
+    fsync = config.FSYNC in ("jars", "always")
+    try:
+        downloaded_hash = await download(download_url, destination, fsync, target_hash, size)
+        logger.info(f"Downloaded {filename} ✅")
+        return downloaded_hash
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 404:
+            logger.error(f"file not found[404 error]: {download_url} ❌")
+        else:
+            logger.exception(f"HTTP error: {e}")
+    except Exception as e:
+        logger.error(f"Unexpected error: {repr(e)}")
 
 
-async def download_file(download_url:str, destination:str, semaphore:asyncio.Semaphore, target_hash:str = None) -> None:
+async def get_maven_md5(artifact_url:str) -> str | None:
     """
-    Downloads a File from given url
+    Gets the md5 a maven repository publishes next to an artifact
+
+    Returns:
+        md5 hash or None if the repository doesnt have one
+    """
+    try:
+        response = await get_mirrored(f"{artifact_url}.md5")
+    except httpx.HTTPError as e:
+        logger.warning(f"Failed to get the checksum of {artifact_url}: {repr(e)}")
+        return None
+    if response.status_code != 200:
+        return None
+    # some repositories put the filename after the hash
+    digest = response.text.strip().split(" ")[0].lower()
+    return digest if len(digest) == 32 else None
+
+async def download_file(download_url:str, destination:str, target_hash:str = None, size:int = 0) -> str:
+    """
+    Downloads a File from given url, the file only appears at destination once it is complete and verified.
+    How many run in parallel is decided by the download scheduler
     
     :param download_url: Description
     :type download_url: str
     :param destination: Description
     :type destination: str
-    :param semaphore: Description
-    :type semaphore: asyncio.Semaphore
+    :param size: expected bytes, larger downloads get a slot first
+    :return: md5 hash of the downloaded file
     """
-    async with semaphore:
-            try:
-                path_obj = Path(destination)
-                dir_path = path_obj.parent
-                os.makedirs(dir_path, exist_ok=True)
-
-                # Download from CDN
-                logger.info(f"Downloading: {download_url}")
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(download_url) as response:
-                        if response.status == 200:
-                            content = await response.read()
-                            
-                            # Verify hash
-                            if target_hash is not None:
-                                downloaded_hash = hashlib.md5(content).hexdigest()
-                                if downloaded_hash != target_hash:
-                                    if not config.NO_HASH_VERIFICATION:
-                                        raise ValueError(f"Hash mismatch for {destination}")
-                                    logger.warning(f"Hash mismatch for {destination}")
-                                
-                            # Save file
-                            async with aiofiles.open(destination, "wb") as f:
-                                await f.write(content)
-                                
-                        else:
-                            raise Exception(f"Failed to download {download_url}: {response.status}")
-                            
-            except Exception as e:
-                logger.error(f"Error downloading {destination}: {e} URL:{download_url}")
-                raise
+    fsync = config.FSYNC == "always"
+    try:
+        path_obj = Path(destination)
+        dir_path = path_obj.parent
+        os.makedirs(dir_path, exist_ok=True)
+
+        # Download from CDN
+        logger.info(f"Downloading: {download_url}")
+        return await download(download_url, destination, fsync, target_hash, size)
+                    
+    except Exception as e:
+        logger.error(f"Error downloading {destination}: {repr(e)} URL:{download_url}")
+        raise
 
 
 
 async def get_asset_metadata(asset_id):
     url = f"https://api.norisk.gg/api/v1/launcher/pack/{asset_id}"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url) as response:
-                logger.info(response.status)
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    logger.warning(f"Failed to fetch assets: {response.status}")
-                    return {}
-
-        except asyncio.TimeoutError:
-            logger.error("Request timed out")
-            return {}
-        except aiohttp.ClientError as e:
-            logger.exception(f"HTTP client error: {e}")
-            return {}
-        except Exception as e:
-            logger.exception(f"Error fetching assets: {e}")
+    try:
+        response = await get_mirrored(url)
+        logger.info(response.status_code)
+        if response.status_code == 200:
+            return response.json()
+        else:
+            logger.warning(f"Failed to fetch assets: {response.status_code}")
             return {}
 
+    except httpx.TimeoutException:
+        logger.error("Request timed out")
+        return {}
+    except httpx.HTTPError as e:
+        logger.exception(f"HTTP client error: {e}")
+        return {}
+    except Exception as e:
+        logger.exception(f"Error fetching assets: {e}")
+        return {}
+
 async def validate_with_norisk_api(username,server_id):
     url = f"{NORISK_API_URL}/launcher/auth/validate/v2"
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                url,
-                params={
-                    "force": True,
-                    "hwid": hashlib.md5(f"{platform.node()}{uuid.getnode()}{platform.machine()}".encode()).hexdigest(),
-                    "username": username,
-                    "server_id": server_id
-                }
-            )
-            if not response.is_success:
-                error_text = response.text
-                logger.debug(f"failed to validate server join with norisk api: {error_text}")
-                raise Exception(f"failed to validate server join with norisk api: {error_text}")
-            return response.json().get("value")
+    client = get_client()
+    try:
+        response = await client.post(
+            url,
+            params={
+                "force": True,
+                "hwid": hashlib.md5(f"{platform.node()}{uuid.getnode()}{platform.machine()}".encode()).hexdigest(),
+                "username": username,
+                "server_id": server_id
+            }
+        )
+        if not response.is_success:
+            error_text = response.text
+            logger.debug(f"failed to validate server join with norisk api: {error_text}")
+            raise Exception(f"failed to validate server join with norisk api: {error_text}")
+        return response.json().get("value")
             
-        except httpx.RequestError as e:
-            logger.debug(f"API request failed: {e}")
-            raise Exception(f"Norisk API request failed: {e}")
+    except httpx.RequestError as e:
+        logger.debug(f"API request failed: {e}")
+        raise Exception(f"Norisk API request failed: {e}")
 
 
 async def request_server_id():
     url = f"{NORISK_API_URL}/launcher/auth/request-server-id"
-    async with httpx.AsyncClient() as client:
-        logger.debug("[API]")
+    client = get_client()
+    logger.debug("[API]")
         
-        try:
-            response = await client.post(
-                    url,
-                    timeout=30
-                )
-            if not response.is_success:
-                error_text = response.text
-                logger.debug(f"failed to get server_id from norisk api: {error_text}")
-                raise Exception(f"failed to get server_id from norisk api: {error_text}")
+    try:
+        response = await client.post(
+                url,
+                timeout=30
+            )
+        if not response.is_success:
+            error_text = response.text
+            logger.debug(f"failed to get server_id from norisk api: {error_text}")
+            raise Exception(f"failed to get server_id from norisk api: {error_text}")
             
-            return response.json().get("serverId")
-        except httpx.RequestError as e:
-            logger.debug(f"Norisk API request failed: {e}")
-            raise Exception(f"Norisk API request failed: {e}")
+        return response.json().get("serverId")
+    except httpx.RequestError as e:
+        logger.debug(f"Norisk API request failed: {e}")
+        raise Exception(f"Norisk API request failed: {e}")
 
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
 async def join_server_session(
@@ -182,47 +484,123 @@ async def join_server_session(
 
     logger.debug(f"Join request - selected_profile: {selected_profile}, server_id: {server_id}")
 
-    async with httpx.AsyncClient() as client:
-        logger.debug("Sending join server request to Minecraft Session API")
+    client = get_client()
+    logger.debug("Sending join server request to Minecraft Session API")
         
-        try:
-            response = await client.post(
-                url,
-                headers={"Content-Type": "application/json"},
-                json=join_request
-            )
+    try:
+        response = await client.post(
+            url,
+            headers={"Content-Type": "application/json"},
+            json=join_request
+        )
             
-            logger.debug(f"Received response with status: {response.status_code}")
+        logger.debug(f"Received response with status: {response.status_code}")
 
-            if not response.is_success:
-                error_text = response.text
-                logger.debug(f"Join server session failed: {error_text}")
-                raise Exception(f"Failed to join server session: {error_text}")
+        if not response.is_success:
+            error_text = response.text
+            logger.debug(f"Join server session failed: {error_text}")
+            raise Exception(f"Failed to join server session: {error_text}")
             
-            logger.debug("API call completed: join_server_session - Successfully joined server session")
+        logger.debug("API call completed: join_server_session - Successfully joined server session")
             
-        except httpx.RequestError as e:
-            logger.debug(f"API request failed: {e}")
-            raise Exception(f"Minecraft API request failed: {e}")
+    except httpx.RequestError as e:
+        logger.debug(f"API request failed: {e}")
+        raise Exception(f"Minecraft API request failed: {e}")
+def read_cached_modpacks() -> dict | None:
+    '''
+    Reads the last modpacks-v3 response from the cache dir
+
+    Returns:
+        {"data": modpacks, "etag": str, "last_modified": str} or None if nothing is cached
+    '''
+    try:
+        with open(f"{config.CACHE_DIR}/modpacks-v3.json", "rb") as f:
+            data = json.loads(f.read())
+        with open(f"{config.CACHE_DIR}/modpacks-v3.meta.json") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    meta["data"] = data
+    return meta
+
+def write_cached_modpacks(response:httpx.Response):
+    '''
+    Stores a modpacks-v3 response and its validators in the cache dir
+    '''
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    # per process temp files, launchers sharing the cache dir can write at the same time
+    temp_path = f"{config.CACHE_DIR}/modpacks-v3.json.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(response.content)
+    os.replace(temp_path, f"{config.CACHE_DIR}/modpacks-v3.json")
+    temp_path = f"{config.CACHE_DIR}/modpacks-v3.meta.json.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "content_hash": hashlib.md5(response.content).hexdigest()
+        }, f)
+    os.replace(temp_path, f"{config.CACHE_DIR}/modpacks-v3.meta.json")
+
+def cached_modpacks_hash() -> str | None:
+    '''
+    Returns:
+        md5 of the cached modpacks-v3 response (the one get_norisk_modpacks returned) or None
+    '''
+    try:
+        with open(f"{config.CACHE_DIR}/modpacks-v3.meta.json") as f:
+            return json.load(f).get("content_hash")
+    except (FileNotFoundError, ValueError):
+        return None
+
 @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-async def get_norisk_modpacks():
+async def fetch_norisk_modpacks(cached:dict = None):
+    '''
+    Requests modpacks-v3 from the norisk api, revalidating the cached copy if there is one
+    '''
     url = f"{NORISK_API_URL}/launcher/modpacks-v3"
-    async with httpx.AsyncClient() as client:
-        logger.info("Getting version profiles from norisk api")
-        try:
-            response = await client.get(
-                url,
-                timeout=30
-            )
-            
-            if not response.is_success:
-                error_text = response.text
-                logger.error(f"failed to get version profiles from norisk api: {error_text}")
-                raise Exception(f"failed to get version profiles from norisk api: {error_text}")
-            
-            return response.json()
-        except httpx.RequestError as e:
-            logger.error(f"Norisk API request failed: {repr(e)}")
-            raise Exception(f"Norisk API request failed: {repr(e)}")
-        except httpx.TimeoutException as e:
-            logger.error(f"Norisk API request timed out: {repr(e)}")
+    logger.info("Getting version profiles from norisk api")
+    headers = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached.get("etag")
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached.get("last_modified")
+    try:
+        response = await get_mirrored(
+            url,
+            headers=headers,
+            timeout=30
+        )
+
+        if cached and response.status_code == 304:
+            logger.info("Cached version profiles are up to date")
+            return cached["data"]
+
+        if not response.is_success:
+            error_text = response.text
+            logger.error(f"failed to get version profiles from norisk api: {error_text}")
+            raise Exception(f"failed to get version profiles from norisk api: {error_text}")
+
+        data = response.json()
+        write_cached_modpacks(response)
+        return data
+    except httpx.RequestError as e:
+        logger.error(f"Norisk API request failed: {repr(e)}")
+        raise Exception(f"Norisk API request failed: {repr(e)}")
+
+async def get_norisk_modpacks():
+    '''
+    Gets modpacks-v3, falls back to the cached copy if the api doesnt answer within MODPACKS_DEADLINE
+
+    Returns:
+        modpacks:dict
+    '''
+    cached = read_cached_modpacks()
+    if cached is None:
+        return await fetch_norisk_modpacks()
+    try:
+        return await asyncio.wait_for(fetch_norisk_modpacks(cached), config.MODPACKS_DEADLINE)
+    except Exception as e:
+        logger.warning(f"Couldnt refresh version profiles, using cached copy: {repr(e)}")
+        return cached["data"]
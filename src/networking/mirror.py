@@ -0,0 +1,252 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+import httpx
+import config
+from networking.api import MIRROR_HASH_HEADER
+from store import ContentStore
+
+logger = logging.getLogger("Mirror")
+
+# responses of these hosts change (pack list, asset manifests) and are revalidated after MIRROR_TTL,
+# everything else is cached until a client expects a different md5 (cdn assets are keyed by pack and path, not content)
+MUTABLE_HOSTS = {"api.norisk.gg"}
+# hosts the mirror fetches from, the maven repositories of the modpacks get added once they are known
+DEFAULT_HOSTS = {"api.norisk.gg", "cdn.norisk.gg", "api.modrinth.com"}
+# tied to the user, never cached
+PRIVATE_PATHS = ("/api/v1/launcher/auth/",)
+MODPACKS_PATH = "/api/v1/launcher/modpacks-v3"
+# urls share this many fetch locks, a fixed number so the mirror doesnt keep one per url it ever served
+LOCK_STRIPES = 64
+
+
+class UpstreamError(Exception):
+    def __init__(self, status:int):
+        super().__init__(f"upstream answered {status}")
+        self.status = status
+
+
+class MirrorCache():
+    '''
+    Content addressed cache of upstream responses
+
+    Bodies are kept as blobs of a ContentStore, mirror/<md5(url)>.json holds the
+    blob hash, validators and content type of every url. Concurrent requests for
+    the same url wait for a single upstream fetch.
+    '''
+    def __init__(self, root):
+        self.root = Path(root)
+        self.store = ContentStore(root)
+        os.makedirs(self.root / "mirror", exist_ok=True)
+        self.client = httpx.Client(
+            follow_redirects=True,
+            timeout=httpx.Timeout(60, connect=10),
+            limits=httpx.Limits(
+                max_connections=config.MAX_CONNECTIONS,
+                max_keepalive_connections=config.MAX_CONNECTIONS,
+                keepalive_expiry=config.KEEPALIVE_EXPIRY
+            )
+        )
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self.hosts = set(DEFAULT_HOSTS)
+        modpacks = self.read_meta(f"https://api.norisk.gg{MODPACKS_PATH}")
+        if modpacks:
+            self.learn_repositories(modpacks)
+
+    def meta_path(self, url:str) -> Path:
+        return self.root / "mirror" / f"{hashlib.md5(url.encode()).hexdigest()}.json"
+
+    def read_meta(self, url:str) -> dict | None:
+        try:
+            with open(self.meta_path(url)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return meta if self.store.has(meta.get("digest")) else None
+
+    def write_meta(self, url:str, meta:dict):
+        path = self.meta_path(url)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, path)
+
+    def lock_for(self, url:str) -> threading.Lock:
+        return self.locks[int(hashlib.md5(url.encode()).hexdigest(), 16) % LOCK_STRIPES]
+
+    def learn_repositories(self, meta:dict):
+        '''
+        Allows the hosts of the maven repositories listed in a modpacks-v3 response
+        '''
+        try:
+            with open(self.store.blob_path(meta["digest"]), "rb") as f:
+                repositories = json.loads(f.read()).get("repositories") or {}
+        except (OSError, ValueError, AttributeError):
+            return
+        for repository in repositories.values():
+            host = urlsplit(repository).hostname
+            if host:
+                self.hosts.add(host)
+
+    def is_fresh(self, url:str, meta:dict | None, expected:str = None) -> bool:
+        if meta is None:
+            return False
+        if expected and meta.get("digest") != expected:
+            return False
+        if urlsplit(url).hostname not in MUTABLE_HOSTS:
+            return True
+        return time.time() - meta.get("fetched", 0) < config.MIRROR_TTL
+
+    def get(self, url:str, expected:str = None) -> dict:
+        '''
+        Args:
+            expected: md5 the client expects, a cached body with another hash is fetched again
+
+        Returns:
+            meta of url, fetched from upstream if it isnt cached, too old or not what the client expects
+
+        Raises:
+            UpstreamError: upstream answered with an error and nothing is cached
+            httpx.HTTPError: upstream couldnt be reached and nothing is cached
+        '''
+        meta = self.read_meta(url)
+        if self.is_fresh(url, meta, expected):
+            return meta
+        with self.lock_for(url):
+            # another request may have refreshed it while this one waited
+            meta = self.read_meta(url)
+            if self.is_fresh(url, meta, expected):
+                return meta
+            try:
+                # validators of a body with the wrong hash would only get it confirmed with a 304
+                mismatched = expected and meta and meta.get("digest") != expected
+                meta = self.refresh(url, meta, conditional=not mismatched)
+            except (UpstreamError, httpx.HTTPError) as e:
+                if meta is None:
+                    raise
+                logger.warning(f"Serving stale {url}: {repr(e)}")
+                return meta
+        if urlsplit(url).path == MODPACKS_PATH:
+            self.learn_repositories(meta)
+        return meta
+
+    def refresh(self, url:str, meta:dict | None, conditional:bool = True) -> dict:
+        headers = {}
+        if meta and conditional:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        temp_path = self.root / "mirror" / f"{hashlib.md5(url.encode()).hexdigest()}.part"
+        with self.client.stream("GET", url, headers=headers) as response:
+            if meta and response.status_code == 304:
+                meta["fetched"] = time.time()
+                self.write_meta(url, meta)
+                return meta
+            if not response.is_success:
+                raise UpstreamError(response.status_code)
+            md5 = hashlib.md5()
+            with open(temp_path, "wb") as f:
+                for chunk in response.iter_bytes(256 * 1024):
+                    md5.update(chunk)
+                    f.write(chunk)
+            meta = {
+                "url": url,
+                "digest": md5.hexdigest(),
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+                "content_type": response.headers.get("content-type", "application/octet-stream"),
+                "fetched": time.time()
+            }
+        try:
+            self.store.add(temp_path, meta["digest"])
+        finally:
+            temp_path.unlink(missing_ok=True)
+        self.write_meta(url, meta)
+        logger.info(f"Cached {url}")
+        return meta
+
+
+class MirrorHandler(BaseHTTPRequestHandler):
+    '''
+    Serves GET /<host>/<path> from the cache, the upstream url is https://<host>/<path>
+    '''
+    protocol_version = "HTTP/1.1"
+    server: "MirrorServer"
+
+    def do_GET(self):
+        host, _, path = self.path.lstrip("/").partition("/")
+        path = f"/{path}"
+        if host not in self.server.cache.hosts or path.startswith(PRIVATE_PATHS):
+            self.send_error(403, "Not mirrored")
+            return
+        url = f"https://{host}{path}"
+        try:
+            meta = self.server.cache.get(url, self.headers.get(MIRROR_HASH_HEADER))
+        except UpstreamError as e:
+            self.send_error(e.status if e.status < 500 else 502)
+            return
+        except (httpx.HTTPError, OSError) as e:
+            logger.warning(f"Failed to fetch {url}: {repr(e)}")
+            self.send_error(502)
+            return
+
+        etag = meta.get("etag")
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        blob = self.server.cache.store.blob_path(meta["digest"])
+        try:
+            f = open(blob, "rb")
+        except FileNotFoundError:
+            self.send_error(502)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            self.send_response(200)
+            self.send_header("Content-Type", meta.get("content_type"))
+            self.send_header("Content-Length", str(size))
+            if etag:
+                self.send_header("ETag", etag)
+            if meta.get("last_modified"):
+                self.send_header("Last-Modified", meta["last_modified"])
+            self.end_headers()
+            self.connection.sendfile(f)
+        self.server.cache.store.touch(meta["digest"])
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class MirrorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cache:MirrorCache):
+        super().__init__(address, MirrorHandler)
+        self.cache = cache
+
+
+def serve():
+    '''
+    Runs the LAN mirror until it is interrupted, blobs go to STORE_PATH if set and CACHE_DIR/mirror-store otherwise
+    '''
+    root = config.STORE_PATH or f"{config.CACHE_DIR}/mirror-store"
+    server = MirrorServer((config.SERVE_HOST, config.SERVE_PORT), MirrorCache(root))
+    logger.info(f"Mirror listening on {config.SERVE_HOST}:{config.SERVE_PORT}, cache in {root}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.cache.client.close()
@@ -0,0 +1,257 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+import httpx
+import config
+
+logger = logging.getLogger("Download Scheduler")
+
+# a request that waits this many times longer than the fastest one seen for its first byte means the host is congested
+LATENCY_FACTOR = 4
+# minimum time between two decreases of the same limit, one burst of errors should only halve it once
+DECREASE_COOLDOWN = 1.0
+# throughput of the last run, used for the ETA of the next one
+THROUGHPUT_PATH = f"{config.CACHE_DIR}/throughput.json"
+# runs that downloaded less than this say nothing about the bandwidth
+MIN_MEASURED_BYTES = 4 * 1024 * 1024
+
+
+class HostLimiter():
+    '''
+    Concurrency limit for a single host that adapts AIMD style
+
+    Every successful request raises the limit by 1/limit (about +1 per round trip),
+    429/5xx/connection errors halve it and slow first bytes shrink it by a fifth.
+    Once more concurrency stops improving throughput the limit stops growing.
+    Waiting requests get their slot largest first, so big files dont end up as the tail of a sync.
+    '''
+    def __init__(self, host:str, initial:int, maximum:int):
+        self.host = host
+        self.limit = float(min(initial, maximum))
+        self.maximum = maximum
+        self.active = 0
+        # (-expected bytes, arrival, future)
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self.arrivals = itertools.count()
+        self.last_decrease = 0.0
+        self.min_latency = None
+        self.requests = 0
+        self.failures = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.last_done = self.started
+        # throughput of the last window of completions, to detect a plateau
+        self.window_start = self.started
+        self.window_bytes = 0
+        self.window_count = 0
+        self.last_window = None
+
+    async def acquire(self, size:int = 0):
+        '''
+        Args:
+            size: expected bytes of the request, larger ones are let through first
+        '''
+        # everyone goes through the heap, so a new request cant take a free slot from a bigger one that waits
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (-size, next(self.arrivals), waiter))
+        self.wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if not waiter.cancelled():
+                # the slot was handed over right before the cancel, pass it on
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.wake()
+
+    def wake(self):
+        '''
+        Hands free slots to the largest waiters, the slot is counted as taken before they even run
+        '''
+        while self.active < int(self.limit) and self.waiters:
+            waiter = heapq.heappop(self.waiters)[2]
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    def decrease(self, factor:float):
+        now = time.perf_counter()
+        if now - self.last_decrease < DECREASE_COOLDOWN:
+            return
+        self.last_decrease = now
+        self.limit = max(1.0, self.limit * factor)
+        logger.debug(f"{self.host}: concurrency lowered to {int(self.limit)}")
+
+    def on_first_byte(self, latency:float):
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        elif latency > self.min_latency * LATENCY_FACTOR and latency > 0.5:
+            self.decrease(0.8)
+
+    def on_success(self, size:int):
+        self.requests += 1
+        self.bytes += size
+        self.last_done = time.perf_counter()
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self.window_bytes += size
+        self.window_count += 1
+        if self.window_count >= max(8, int(self.limit)):
+            now = time.perf_counter()
+            throughput = self.window_bytes / max(now - self.window_start, 1e-6)
+            if self.last_window and self.limit > self.last_window[1] and throughput < self.last_window[0] * 0.9:
+                # more concurrency made it slower, go back to where it was faster
+                self.limit = self.last_window[1]
+            self.last_window = (throughput, self.limit)
+            self.window_start = now
+            self.window_bytes = 0
+            self.window_count = 0
+        self.wake()
+
+    def on_failure(self, e:BaseException):
+        self.requests += 1
+        self.failures += 1
+        if isinstance(e, httpx.HTTPStatusError):
+            status = e.response.status_code
+            if status == 429 or status >= 500:
+                self.decrease(0.5)
+        elif isinstance(e, httpx.TransportError):
+            self.decrease(0.5)
+
+
+class Slot():
+    '''
+    One running request, feeds its latency, size and outcome back into the limiter
+    '''
+    def __init__(self, limiter:HostLimiter, expected:int):
+        self.limiter = limiter
+        self.expected = expected
+        self.started = 0.0
+        self.size = 0
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.expected)
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.release()
+        if exc is None:
+            self.limiter.on_success(self.size)
+        elif not isinstance(exc, asyncio.CancelledError):
+            self.limiter.on_failure(exc)
+        return False
+
+    def first_byte(self):
+        self.limiter.on_first_byte(time.perf_counter() - self.started)
+
+    def add_bytes(self, size:int):
+        self.size += size
+
+
+class DownloadScheduler():
+    '''
+    Shared by every download of a run, keeps one adaptive limiter per host
+
+    Mods and assets announce their downloads with enqueue, so the total and the ETA
+    of everything that is still coming are known before the first byte arrives.
+    '''
+    def __init__(self):
+        self.limiters: dict[str, HostLimiter] = {}
+        self.queued_files = 0
+        self.queued_bytes = 0
+
+    def max_concurrency(self, host:str) -> int:
+        from networking import api
+        if host == api.CDN_HOST and api.use_http2():
+            # streams are multiplexed, the connection pool isnt the limit
+            return config.MAX_CONCURRENCY
+        if host in api.POOLED_HOSTS:
+            return min(config.MAX_CONCURRENCY, config.MAX_CONNECTIONS_PER_HOST)
+        return min(config.MAX_CONCURRENCY, config.MAX_CONNECTIONS)
+
+    def slot(self, url:str, size:int = 0) -> Slot:
+        '''
+        Args:
+            size: expected bytes, decides the order in which waiting requests of a host start
+        '''
+        host = urlsplit(url).hostname or ""
+        if host not in self.limiters:
+            self.limiters[host] = HostLimiter(host, config.INITIAL_CONCURRENCY, self.max_concurrency(host))
+        return Slot(self.limiters[host], size)
+
+    def enqueue(self, kind:str, sizes:list[int]):
+        '''
+        Announces downloads that are about to start and logs the total with an ETA
+
+        Args:
+            kind: what is downloaded, only for the log
+            sizes: expected bytes of every file
+        '''
+        if not sizes:
+            return
+        self.queued_files += len(sizes)
+        self.queued_bytes += sum(sizes)
+        message = f"Queued {len(sizes)} {kind} ({sum(sizes) / 1024 / 1024:.1f} MiB), {self.queued_files} files ({self.queued_bytes / 1024 / 1024:.1f} MiB) in total"
+        throughput = read_throughput()
+        if throughput:
+            done = sum(limiter.bytes for limiter in self.limiters.values())
+            eta = max(self.queued_bytes - done, 0) / throughput
+            message += f", ETA {eta:.0f}s at {throughput / 1024 / 1024:.1f} MiB/s"
+        logger.info(message)
+
+    def log_summary(self):
+        for host, limiter in self.limiters.items():
+            elapsed = time.perf_counter() - limiter.started
+            logger.info(
+                f"{host}: {limiter.requests} requests, {limiter.failures} failed, "
+                f"{limiter.bytes / 1024 / 1024 / max(elapsed, 1e-6):.2f} MiB/s, final concurrency {int(limiter.limit)}"
+            )
+        total = sum(limiter.bytes for limiter in self.limiters.values())
+        if total >= MIN_MEASURED_BYTES:
+            elapsed = max(l.last_done for l in self.limiters.values()) - min(l.started for l in self.limiters.values())
+            write_throughput(total / max(elapsed, 1e-6))
+
+
+def read_throughput() -> float | None:
+    '''
+    Returns:
+        bytes per second of the last run that downloaded enough to measure it
+    '''
+    try:
+        with open(THROUGHPUT_PATH) as f:
+            return json.load(f).get("bytes_per_second")
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_throughput(bytes_per_second:float):
+    try:
+        os.makedirs(config.CACHE_DIR, exist_ok=True)
+        temp_path = f"{THROUGHPUT_PATH}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"bytes_per_second": bytes_per_second}, f)
+        os.replace(temp_path, THROUGHPUT_PATH)
+    except OSError as e:
+        logger.warning(f"Failed to save the download throughput: {e}")
+
+
+_scheduler: DownloadScheduler | None = None
+_scheduler_loop = None
+
+def get_scheduler() -> DownloadScheduler:
+    '''
+    Returns the scheduler of the running event loop
+    '''
+    global _scheduler, _scheduler_loop
+    loop = asyncio.get_running_loop()
+    if _scheduler is None or _scheduler_loop is not loop:
+        _scheduler = DownloadScheduler()
+        _scheduler_loop = loop
+    return _scheduler
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+import tracing
+
+logger = logging.getLogger("Pipeline")
+
+
+class Node():
+    def __init__(self, name:str, func, deps:list[str]):
+        self.name = name
+        self.func = func
+        self.deps = deps
+        self.start = 0.0
+        self.end = 0.0
+
+
+class Pipeline():
+    '''
+    Runs async steps as a dependency graph, every step starts as soon as the steps it depends on are done
+
+    Steps get the results of all finished steps and their result is stored under their name.
+    If a step fails everything still running is cancelled and the error is raised.
+    '''
+    def __init__(self):
+        self.nodes: dict[str, Node] = {}
+        self.results = {}
+        self.started = 0.0
+
+    def add(self, name:str, func, deps:list[str] = None):
+        '''
+        Args:
+            func: async function that gets the results dict
+            deps: names of the steps that have to finish first
+        '''
+        for dep in deps or []:
+            if dep not in self.nodes:
+                raise ValueError(f"{name} depends on unknown step {dep}")
+        self.nodes[name] = Node(name, func, deps or [])
+
+    async def run_node(self, node:Node, tasks:dict[str, asyncio.Task]):
+        await asyncio.gather(*(tasks[dep] for dep in node.deps))
+        node.start = time.perf_counter()
+        with tracing.span(node.name):
+            self.results[node.name] = await node.func(self.results)
+        node.end = time.perf_counter()
+
+    async def run(self) -> dict:
+        '''
+        Returns:
+            name -> result of every step
+        '''
+        self.started = time.perf_counter()
+        tasks: dict[str, asyncio.Task] = {}
+        # steps can only depend on steps added before them, so this order is topological
+        for node in self.nodes.values():
+            tasks[node.name] = asyncio.create_task(self.run_node(node, tasks), name=node.name)
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        logger.info(f"Critical path: {self.format_critical_path()}")
+        return self.results
+
+    def critical_path(self) -> list[Node]:
+        '''
+        Returns:
+            the chain of steps that decided the total time, from the first to the last
+        '''
+        node = max(self.nodes.values(), key=lambda n: n.end)
+        path = [node]
+        while node.deps:
+            node = max((self.nodes[dep] for dep in node.deps), key=lambda n: n.end)
+            path.append(node)
+        return path[::-1]
+
+    def format_critical_path(self) -> str:
+        path = self.critical_path()
+        steps = " -> ".join(f"{node.name} {node.end - node.start:.2f}s" for node in path)
+        return f"{steps} (total {path[-1].end - self.started:.2f}s)"
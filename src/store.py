@@ -0,0 +1,266 @@
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+import config
+import filelock
+import hashing
+
+logger = logging.getLogger("Content Store")
+
+# ioctl number of FICLONE (linux reflink)
+FICLONE = 0x40049409
+GC_INTERVAL = 24 * 60 * 60
+
+
+def reflink(src, dst) -> bool:
+    '''
+    Creates a copy on write clone of src, only works on linux filesystems that support it (btrfs, xfs)
+    '''
+    if sys.platform != "linux":
+        return False
+    import fcntl
+    try:
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+def copy_range(src, dst):
+    '''
+    Copies src to dst, in kernel space if the platform supports copy_file_range
+    '''
+    if not hasattr(os, "copy_file_range"):
+        shutil.copyfile(src, dst)
+        return
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        remaining = os.fstat(s.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            s.seek(0)
+            d.seek(0)
+            d.truncate()
+            shutil.copyfileobj(s, d)
+
+def clone_file(src, dst):
+    '''
+    Places src at dst as a hardlink, reflink or copy (first one that works), replacing dst atomically
+    '''
+    temp_path = f"{dst}.store-tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    try:
+        os.link(src, temp_path)
+    except OSError:
+        if not reflink(src, temp_path):
+            copy_range(src, temp_path)
+    os.replace(temp_path, dst)
+
+
+class ContentStore():
+    '''
+    Global store of mod jars and assets, shared by every instance and keyed by md5 hash
+
+    Every instance records the hashes it uses in refs/<instance>.json, a blob
+    is only garbage collected once no instance references it anymore and it
+    wasnt used for STORE_GC_DAYS.
+    '''
+    def __init__(self, root):
+        self.root = Path(root)
+        self.instance_path = os.path.abspath(os.getcwd())
+        self.instance_id = hashlib.md5(self.instance_path.encode()).hexdigest()
+        self.refs = set()
+        os.makedirs(self.root / "objects", exist_ok=True)
+        os.makedirs(self.root / "urls", exist_ok=True)
+        os.makedirs(self.root / "refs", exist_ok=True)
+        os.makedirs(self.root / "locks", exist_ok=True)
+        os.makedirs(self.root / "used", exist_ok=True)
+
+    def blob_path(self, digest:str) -> Path:
+        return self.root / "objects" / digest[:2] / digest
+
+    def used_path(self, digest:str) -> Path:
+        return self.root / "used" / digest[:2] / digest
+
+    def touch(self, digest:str):
+        '''
+        Records that digest was just used, in a stamp file of its own since the blob
+        inode is shared with the hardlinked copies of every instance and their stat keyed caches
+        '''
+        stamp = self.used_path(digest)
+        try:
+            os.makedirs(stamp.parent, exist_ok=True)
+            stamp.touch()
+        except OSError as e:
+            logger.warning(f"Failed to mark {digest} as used: {e}")
+
+    def last_used(self, blob:Path, st:os.stat_result) -> float:
+        try:
+            return max(st.st_mtime, self.used_path(blob.name).stat().st_mtime)
+        except FileNotFoundError:
+            # blobs from before the stamps existed
+            return st.st_mtime
+
+    def url_path(self, url:str) -> Path:
+        return self.root / "urls" / hashlib.md5(url.encode()).hexdigest()
+
+    def has(self, digest:str) -> bool:
+        return digest is not None and self.blob_path(digest).is_file()
+
+    def use(self, digest:str):
+        '''
+        Marks digest as referenced by this instance
+        '''
+        if digest:
+            self.refs.add(digest)
+
+    def lookup_url(self, url:str) -> str | None:
+        '''
+        Returns the hash of the blob that was downloaded from url
+        '''
+        try:
+            digest = self.url_path(url).read_text().strip()
+        except FileNotFoundError:
+            return None
+        return digest if self.has(digest) else None
+
+    def lock(self, key:str) -> filelock.FileLock:
+        '''
+        Lock for fetching one blob into the store, other instances wait on it and link the result
+
+        Args:
+            key: md5 of the blob or of its url if the hash isnt known before downloading
+        '''
+        return filelock.FileLock(self.root / "locks" / f"{key}.lock", remove=True, timeout=config.DOWNLOAD_DEADLINE)
+
+    def evict(self, digest:str):
+        self.blob_path(digest).unlink(missing_ok=True)
+        self.used_path(digest).unlink(missing_ok=True)
+
+    async def link(self, digest:str, destination) -> bool:
+        '''
+        Materializes a blob at destination, after checking that it still has the content of digest.
+        Blobs are hardlinked into the instances, so a copy that was edited in place changed the blob too.
+
+        Returns:
+            False if the blob isnt in the store or was damaged, it gets downloaded again then
+        '''
+        if not self.has(digest):
+            return False
+        blob = self.blob_path(digest)
+        try:
+            if await hashing.calc_hash(blob) != digest:
+                logger.warning(f"{digest} in the content store was damaged, downloading it again")
+                self.evict(digest)
+                return False
+        except OSError as e:
+            logger.warning(f"Failed to check {digest} in the content store: {e}")
+            return False
+        os.makedirs(Path(destination).parent, exist_ok=True)
+        try:
+            clone_file(blob, destination)
+        except OSError as e:
+            logger.warning(f"Failed to link {digest} to {destination}: {e}")
+            return False
+        self.touch(digest)
+        self.use(digest)
+        return True
+
+    def add(self, file, digest:str, url:str = None):
+        '''
+        Adds an already verified file to the store
+
+        Args:
+            file: file that has the content of digest
+            url: url the file was downloaded from, for lookup_url
+        '''
+        self.use(digest)
+        self.touch(digest)
+        blob = self.blob_path(digest)
+        try:
+            if not blob.is_file():
+                os.makedirs(blob.parent, exist_ok=True)
+                clone_file(file, blob)
+            if url:
+                with open(self.url_path(url), "w") as f:
+                    f.write(digest)
+        except OSError as e:
+            logger.warning(f"Failed to add {file} to the content store: {e}")
+
+    def save_refs(self):
+        with open(self.root / "refs" / f"{self.instance_id}.json", "w") as f:
+            json.dump({"path": self.instance_path, "hashes": sorted(self.refs)}, f)
+
+    def gc(self, force=False):
+        '''
+        Removes blobs no instance references anymore, runs at most once a day unless forced
+        '''
+        stamp = self.root / "last-gc"
+        if not force and stamp.is_file() and time.time() - stamp.stat().st_mtime < GC_INTERVAL:
+            return
+        stamp.touch()
+
+        referenced = set()
+        for ref_file in (self.root / "refs").glob("*.json"):
+            try:
+                with open(ref_file) as f:
+                    refs = json.load(f)
+            except ValueError:
+                continue
+            if not os.path.isdir(refs.get("path")):
+                # the instance was deleted
+                ref_file.unlink()
+                continue
+            referenced.update(refs.get("hashes"))
+
+        cutoff = time.time() - config.STORE_GC_DAYS * 24 * 60 * 60
+        removed = 0
+        freed = 0
+        for blob in (self.root / "objects").glob("*/*"):
+            if blob.name in referenced:
+                continue
+            st = blob.stat()
+            if self.last_used(blob, st) < cutoff:
+                blob.unlink()
+                self.used_path(blob.name).unlink(missing_ok=True)
+                removed += 1
+                freed += st.st_size
+        if removed:
+            logger.info(f"Removed {removed} unused files from the content store ({freed / 1024 / 1024:.1f} MiB)")
+
+    def finish(self):
+        '''
+        Saves this instances references and collects garbage
+        '''
+        try:
+            self.save_refs()
+            self.gc()
+        except OSError as e:
+            logger.warning(f"Content store cleanup failed: {e}")
+
+
+_store: ContentStore | None = None
+
+def get_store() -> ContentStore | None:
+    '''
+    Returns the global content store or None if STORE_PATH isnt set
+    '''
+    global _store
+    if _store is None and config.STORE_PATH:
+        _store = ContentStore(config.STORE_PATH)
+    return _store
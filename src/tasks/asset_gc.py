@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import time
+from pathlib import Path
+import config
+
+logger = logging.getLogger("Asset GC")
+
+INVENTORY_VERSION = 1
+# files looked at by the walk that finds untracked leftovers, per launch
+SCAN_BUDGET = 5000
+# files removed per launch, whatever is left is removed on the next launches
+REMOVE_BUDGET = 1000
+# a finished walk is repeated after this long to catch files that werent put there by the wrapper
+RESCAN_INTERVAL = 7 * 24 * 60 * 60
+# quarantined files are deleted after this long
+QUARANTINE_DAYS = 7
+
+
+def base_path(path:str) -> str:
+    '''
+    Maps the .part and .lock files of unfinished downloads to the asset they belong to
+    '''
+    for suffix in (".part.json", ".part", ".lock"):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+class AssetInventory():
+    '''
+    Tracks which files below ASSET_PATH the manifests reference and removes the rest a bit at a time
+
+    Assets that drop out of the manifests are known from the last launch without touching the disk,
+    files from before the inventory existed are found by a walk that continues where it stopped.
+    '''
+    def __init__(self, asset_path:str, path:str):
+        self.asset_path = asset_path
+        self.path = path
+        self.tracked: set[str] = set()
+        self.pending: set[str] = set()
+        self.scan_queue: list[str] = [""]
+        self.scanned_at = 0.0
+        self.quarantined: dict[str, float] = {}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        if data.get("version") != INVENTORY_VERSION:
+            return
+        self.tracked = set(data.get("tracked", []))
+        self.pending = set(data.get("pending", []))
+        self.scan_queue = data.get("scan_queue", [""])
+        self.scanned_at = data.get("scanned_at", 0.0)
+        self.quarantined = data.get("quarantined", {})
+
+    def save(self):
+        os.makedirs(Path(self.path).parent, exist_ok=True)
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({
+                "version": INVENTORY_VERSION,
+                "tracked": sorted(self.tracked),
+                "pending": sorted(self.pending),
+                "scan_queue": self.scan_queue,
+                "scanned_at": self.scanned_at,
+                "quarantined": self.quarantined
+            }, f)
+        os.replace(temp_path, self.path)
+
+    def scan(self, referenced:set[str]):
+        '''
+        Continues the walk for untracked files until SCAN_BUDGET files were looked at
+        '''
+        if not self.scan_queue:
+            if time.time() - self.scanned_at < RESCAN_INTERVAL:
+                return
+            self.scan_queue = [""]
+        budget = SCAN_BUDGET
+        while self.scan_queue and budget > 0:
+            directory = self.scan_queue.pop()
+            try:
+                entries = list(os.scandir(os.path.join(self.asset_path, directory)))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                path = f"{directory}/{entry.name}" if directory else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    self.scan_queue.append(path)
+                elif base_path(path) not in referenced:
+                    self.pending.add(path)
+            budget -= len(entries)
+        if not self.scan_queue:
+            self.scanned_at = time.time()
+
+    def remove(self, path:str) -> int:
+        '''
+        Deletes or quarantines a single file
+
+        Returns:
+            bytes freed
+        '''
+        file = Path(self.asset_path) / path
+        try:
+            size = file.stat().st_size
+            if config.ASSET_GC == "quarantine":
+                target = Path(config.CACHE_DIR) / "asset-quarantine" / path
+                os.makedirs(target.parent, exist_ok=True)
+                os.replace(file, target)
+                self.quarantined[path] = time.time()
+            else:
+                file.unlink()
+        except FileNotFoundError:
+            return 0
+        # drop directories that are empty now
+        parent = file.parent
+        try:
+            while parent != Path(self.asset_path):
+                parent.rmdir()
+                parent = parent.parent
+        except OSError:
+            pass
+        return size
+
+    def purge_quarantine(self):
+        cutoff = time.time() - QUARANTINE_DAYS * 24 * 60 * 60
+        for path, quarantined_at in list(self.quarantined.items()):
+            if quarantined_at < cutoff:
+                (Path(config.CACHE_DIR) / "asset-quarantine" / path).unlink(missing_ok=True)
+                del self.quarantined[path]
+
+    def collect(self, referenced:set[str]):
+        '''
+        Removes up to REMOVE_BUDGET files that no manifest references anymore and logs what it freed
+
+        Args:
+            referenced: asset paths of the current manifests, must be complete or referenced files get removed
+        '''
+        self.load()
+        for path in self.tracked - referenced:
+            self.pending.update((path, f"{path}.part", f"{path}.part.json"))
+        self.tracked = set(referenced)
+        self.scan(referenced)
+        self.pending = {path for path in self.pending if base_path(path) not in referenced}
+
+        # cosmetics first, they end up in the overlay jar
+        batch = sorted(self.pending, key=lambda path: (not path.startswith("nrc-cosmetics/"), path))[:REMOVE_BUDGET]
+        removed = 0
+        freed = 0
+        for path in batch:
+            try:
+                size = self.remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to remove unused asset {path}: {e}")
+                continue
+            self.pending.discard(path)
+            if size:
+                removed += 1
+                freed += size
+        self.purge_quarantine()
+        self.save()
+
+        if removed:
+            action = "Quarantined" if config.ASSET_GC == "quarantine" else "Removed"
+            left = f", {len(self.pending)} left for the next launches" if self.pending else ""
+            logger.info(f"{action} {removed} unused assets ({freed / 1024 / 1024:.1f} MiB){left}")
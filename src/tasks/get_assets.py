@@ -1,88 +1,182 @@
 import asyncio
+import contextlib
+import copy
 from dataclasses import dataclass
-import hashlib
 import json
 import logging
 import os
+import shutil
+import struct
+import time
 import zipfile
 from pathlib import Path
 import config
+import hashing
+import store
+import tracing
 import networking.api as api
+from networking.scheduler import get_scheduler
+from tasks.asset_gc import AssetInventory
 
 logger = logging.getLogger("Assets")
 
 # assets that are ignored
 IGNORE_LIST = ["nrc-cosmetics/pack.mcmeta"]
+# assets below this path are put into the cosmetics overlay jar
+COSMETICS_PREFIX = "nrc-cosmetics/"
+# fabric mod id of the overlay, it sorts after nrc-core so its assets take precedence
+OVERLAY_MOD_ID = "nrc-cosmetics-overlay"
+# bump when the layout of the overlay jar changes
+OVERLAY_VERSION = 1
 
 ASSET_PATH = "NoRiskClient/assets"
-os.makedirs(ASSET_PATH,exist_ok=True)
 
 
-#TODO/CHORE expose this as setting
-concurrent_downloads = 20
+# formats that are already compressed, deflating them again only costs cpu time
+STORED_SUFFIXES = {".png", ".ogg", ".jpg", ".jpeg", ".gif", ".zip", ".jar"}
+COPY_CHUNK_SIZE = 1024 * 1024
 
-async def calc_hash(file:Path):
+hash_cache = hashing.HashCache(f"{config.CACHE_DIR}/asset-hashes.json")
+inventory = AssetInventory(ASSET_PATH, f"{config.CACHE_DIR}/asset-inventory.json")
+
+def copy_raw_entry(original_fp, item:zipfile.ZipInfo, updated_jar:zipfile.ZipFile):
     '''
-    Calculates the md5 hash for given path
-    
+    Copies a zip entry (local header, compressed data and data descriptor) byte for byte,
+    without decompressing and compressing it again
+
     Args:
-        file: path to a file
+        original_fp: open binary file of the source zip
+        item: entry of the source zip
+        updated_jar: zip opened for writing
     '''
-    with open(file,'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
+    original_fp.seek(item.header_offset)
+    header = original_fp.read(zipfile.sizeFileHeader)
+    name_length, extra_length = struct.unpack("<26xHH", header)
+    length = name_length + extra_length + item.compress_size
+    if item.flag_bits & 0x08:
+        # sizes and crc follow the data in a data descriptor, with an optional signature
+        original_fp.seek(item.header_offset + zipfile.sizeFileHeader + length)
+        length += 16 if original_fp.read(4) == b"PK\x07\x08" else 12
+        original_fp.seek(item.header_offset + zipfile.sizeFileHeader)
+
+    new_item = copy.copy(item)
+    new_item.header_offset = updated_jar.fp.tell()
+    updated_jar.fp.write(header)
+    while length > 0:
+        chunk = original_fp.read(min(length, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated entry {item.filename}")
+        updated_jar.fp.write(chunk)
+        length -= len(chunk)
+    updated_jar.filelist.append(new_item)
+    updated_jar.NameToInfo[new_item.filename] = new_item
+    # the next entry and the central directory are written from here on
+    updated_jar.start_dir = updated_jar.fp.tell()
 
-async def injectIntoJar():
+def overlay_path() -> Path:
     '''
-    Injects NRC assets into nrc-core jarfile
+    Returns:
+        absolute path of the cosmetics overlay jar, it is passed to the game via -Dfabric.addMods
     '''
-    logger.info("Injecting Assets into jarfile")
-    with open(".nrc-index.json") as f:
-        index = json.load(f)
+    return Path(config.CACHE_DIR).resolve() / "overlay" / f"{OVERLAY_MOD_ID}.jar"
 
-    core_mod = next((mod for mod in index if mod.get("id") == "nrc-core"), None)
-    source_path = Path("NoRiskClient/assets/nrc-cosmetics/assets")
-    files_to_add = []
+def overlay_files() -> dict[str, Path]:
+    '''
+    Returns:
+        path in the jar -> path on disk of every nrc-cosmetics asset
+    '''
+    source_path = Path(ASSET_PATH) / COSMETICS_PREFIX / "assets"
+    files = {}
     for file_path in source_path.rglob('*'):
-        if file_path.is_file():
-            rel_path = file_path.relative_to(source_path)
-            jar_path_entry = str(Path("assets") / rel_path).replace('\\', '/')
-            files_to_add.append((file_path, jar_path_entry))
+        if file_path.is_file() and not api.is_partial(file_path):
+            files[(Path("assets") / file_path.relative_to(source_path)).as_posix()] = file_path
+    return files
 
-    mods_dir = Path(config.NRC_MOD_PATH)
-    target_hash = core_mod.get("hash")
-    
-    for file in mods_dir.glob("*.jar"):
-        if await calc_hash(file) == target_hash:
-            temp_jar_path = file.with_suffix('.temp.jar')
-            
-            try:
-                with zipfile.ZipFile(file, 'r') as original_jar:
-                    with zipfile.ZipFile(temp_jar_path, 'w', compression=zipfile.ZIP_DEFLATED) as updated_jar:
-                        logger.info("Updating JAR file")
-                        
-                        assets_to_replace = {jar_path for _, jar_path in files_to_add}
-                        for item in original_jar.infolist():
-                            if item.filename not in assets_to_replace:
-                                updated_jar.writestr(item, original_jar.read(item.filename))
-                        
-                        for file_path, jar_path in files_to_add:
-                            with open(file_path, 'rb') as f:
-                                updated_jar.writestr(jar_path, f.read())
-                
-                file.unlink()
-                temp_jar_path.rename(file)
-                
-                core_mod["hash"] = await calc_hash(file)
-                with open(".nrc-index.json", 'w') as f:
-                    json.dump(index, f, indent=2)
-                logger.info("Successfully updated JAR file!")
-                break
-                
-            except Exception as e:
-                if temp_jar_path.exists():
-                    temp_jar_path.unlink()
-                logger.error(f"Error updating JAR: {e}")
-                raise
+def write_overlay(target:Path, files:dict[str, Path], previous:Path | None, reuse:set[str]):
+    '''
+    Writes the overlay jar, a fabric mod that only contains the cosmetics assets
+
+    Args:
+        files: path in the jar -> path on disk
+        previous: the last overlay jar, entries listed in reuse are copied from it raw
+    '''
+    with zipfile.ZipFile(target, 'w') as jar:
+        jar.writestr("fabric.mod.json", json.dumps({
+            "schemaVersion": 1,
+            "id": OVERLAY_MOD_ID,
+            "version": "1.0.0",
+            "name": "NoRisk Client Cosmetics",
+            "description": "Generated by the nrc wrapper from the nrc-cosmetics assets",
+            "environment": "client"
+        }, indent=2), zipfile.ZIP_DEFLATED)
+        previous_fp = open(previous, 'rb') if previous and reuse else None
+        try:
+            previous_jar = zipfile.ZipFile(previous_fp) if previous_fp else None
+            for jar_path, file_path in sorted(files.items()):
+                if jar_path in reuse:
+                    copy_raw_entry(previous_fp, previous_jar.getinfo(jar_path), jar)
+                    continue
+                item = zipfile.ZipInfo.from_file(file_path, jar_path)
+                if file_path.suffix.lower() in STORED_SUFFIXES:
+                    item.compress_type = zipfile.ZIP_STORED
+                else:
+                    item.compress_type = zipfile.ZIP_DEFLATED
+                with open(file_path, 'rb') as src, jar.open(item, 'w') as dest:
+                    shutil.copyfileobj(src, dest, COPY_CHUNK_SIZE)
+        finally:
+            if previous_fp:
+                previous_fp.close()
+
+def read_overlay_state() -> dict:
+    try:
+        with open(overlay_path().with_suffix(".json")) as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return state if state.get("version") == OVERLAY_VERSION else {}
+
+async def build_overlay():
+    '''
+    Builds the overlay jar that adds the nrc-cosmetics assets to the game, nrc-core itself stays as it was downloaded
+
+    Only assets whose size or mtime changed get compressed again, everything else is copied over from the last overlay.
+    '''
+    target = overlay_path()
+    files = overlay_files()
+    if not files:
+        logger.warning("No nrc-cosmetics assets found, starting without the cosmetics overlay")
+        target.unlink(missing_ok=True)
+        return
+    stats = {}
+    for jar_path, file_path in files.items():
+        st = file_path.stat()
+        stats[jar_path] = [st.st_size, st.st_mtime_ns]
+
+    state = read_overlay_state()
+    try:
+        st = target.stat()
+        previous_valid = state.get("size") == st.st_size and state.get("mtime_ns") == st.st_mtime_ns
+    except FileNotFoundError:
+        previous_valid = False
+    if previous_valid and state.get("files") == stats:
+        logger.info("Cosmetics overlay is up to date")
+        return
+
+    previous_files = state.get("files", {}) if previous_valid else {}
+    reuse = {jar_path for jar_path, stat in stats.items() if previous_files.get(jar_path) == stat}
+    os.makedirs(target.parent, exist_ok=True)
+    temp_path = target.with_suffix(".tmp")
+    try:
+        # in a thread, the other downloads keep running while the jar is written
+        await asyncio.to_thread(write_overlay, temp_path, files, target, reuse)
+        os.replace(temp_path, target)
+    except Exception:
+        temp_path.unlink(missing_ok=True)
+        raise
+    st = target.stat()
+    with open(target.with_suffix(".json"), "w") as f:
+        json.dump({"version": OVERLAY_VERSION, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "files": stats}, f)
+    logger.info(f"Built the cosmetics overlay, {len(files) - len(reuse)} of {len(files)} assets changed")
 
 @dataclass
 class Assetfile():
@@ -94,24 +188,42 @@ class Assetfile():
 
     async def verify(self):
         file_path = Path(f"{ASSET_PATH}/{self.path}")
-        if file_path.is_file():
-            local_hash = await calc_hash(file_path)
-            if not local_hash == self.sha:
-                self.is_verified = False
-                return False
-        else:
+        local_hash = await hash_cache.get_hash(file_path)
+        if local_hash is None or not local_hash == self.sha:
             self.is_verified = False
             return False
         self.is_verified = True
         return True
 
-    async def download(self,semaphore:asyncio.Semaphore=asyncio.Semaphore(10)):
-        url = f"https://cdn.norisk.gg/assets/{self.asset_id}/assets/{self.path}"
-        await api.download_file(url,f"{ASSET_PATH}/{self.path}",semaphore,target_hash=self.sha)
+    async def download(self):
+        content_store = store.get_store()
+        destination = f"{ASSET_PATH}/{self.path}"
+        # another instance fetching the same blob finishes first, then it gets linked from the store
+        async with content_store.lock(self.sha) if content_store else contextlib.nullcontext():
+            if content_store and await content_store.link(self.sha, destination):
+                return
+            url = f"https://cdn.norisk.gg/assets/{self.asset_id}/assets/{self.path}"
+            digest = await api.download_file(url,destination,target_hash=self.sha,size=self.size)
+            if content_store and digest == self.sha:
+                content_store.add(destination, self.sha)
 
     
-async def run(asset_packs):
-    assets = list(set(asset_packs))
+def is_cosmetic(resource:Assetfile) -> bool:
+    return resource.path.startswith(COSMETICS_PREFIX)
+
+async def prepare(asset_packs, collect_garbage:bool = True) -> list[Assetfile]:
+    '''
+    Gets the metadata of the asset packs and verifies the installed assets against it
+
+    Args:
+        collect_garbage: remove unused assets, the background sync doesnt since the game may be reading them
+
+    Returns:
+        assets that have to be downloaded
+    '''
+    os.makedirs(ASSET_PATH,exist_ok=True)
+    # asset packs come in override order (most specific first), duplicates are dropped without reordering
+    assets = list(dict.fromkeys(asset_packs))
 
     # get metadata
     tasks = []
@@ -119,7 +231,8 @@ async def run(asset_packs):
 
     for a in assets:
         tasks.append(get_metadata(a,meta_data))
-    await asyncio.gather(*tasks)
+    with tracing.span("asset metadata"):
+        await asyncio.gather(*tasks)
     assets.reverse()
 
     master_assets:dict[str, Assetfile] = {}
@@ -129,15 +242,49 @@ async def run(asset_packs):
         for id, resource in meta_data[assetpack].items():
             master_assets[resource.path] = resource
 
+    # unused assets are only removed if every manifest was fetched, a missing one would mark its assets unused
+    if collect_garbage and config.ASSET_GC != "off" and all(meta_data[a] for a in assets):
+        with tracing.span("asset gc"):
+            await asyncio.to_thread(inventory.collect, set(master_assets))
 
-    download_tasks = []
-    semaphore = asyncio.Semaphore(concurrent_downloads)
+    # verify everything in one batch so changed files get hashed in parallel
+    with tracing.span("asset verify", files=len(master_assets)):
+        local_hashes = await hash_cache.get_hashes([f"{ASSET_PATH}/{path}" for path in master_assets])
+    for resource, local_hash in zip(master_assets.values(), local_hashes):
+        resource.is_verified = local_hash == resource.sha
+
+    missing = []
+    content_store = store.get_store()
     for path, resource in master_assets.items():
-        if await resource.verify() or path in IGNORE_LIST: 
+        if resource.is_verified:
+            if content_store:
+                if content_store.has(resource.sha):
+                    content_store.use(resource.sha)
+                else:
+                    content_store.add(f"{ASSET_PATH}/{path}", resource.sha)
+            continue
+        if path in IGNORE_LIST:
             continue
-        download_tasks.append(resource.download(semaphore=semaphore))
+        missing.append(resource)
     
-    await asyncio.gather(*download_tasks)
+    hash_cache.save(prune=True)
+    return missing
+
+async def download(missing:list[Assetfile], kind:str = "assets"):
+    '''
+    Downloads the given assets, largest first so they dont become the tail and small ones fill the gaps
+
+    Args:
+        missing: assets from prepare
+        kind: what they are, only for the log
+    '''
+    download_size = sum(resource.size for resource in missing)
+    missing = sorted(missing, key=lambda resource: resource.size, reverse=True)
+    get_scheduler().enqueue(kind, [resource.size for resource in missing])
+    started = time.perf_counter()
+    await asyncio.gather(*(resource.download() for resource in missing))
+    if missing:
+        logger.info(f"Downloaded {len(missing)} assets ({download_size / 1024 / 1024:.1f} MiB) in {time.perf_counter() - started:.1f}s, cdn transport: {config.CDN_TRANSPORT} {dict(api.http_versions)}")
     
 
 async def get_metadata(asset_pack_name:str,metadata_dict:dict):
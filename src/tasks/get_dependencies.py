@@ -1,4 +1,6 @@
+from importlib import metadata
 from importlib.machinery import SourceFileLoader
+import hashlib
 import os
 from pathlib import Path
 import subprocess
@@ -7,19 +9,89 @@ import logging
 import tempfile
 logger = logging.getLogger("Dependency Checker")
 
+# NRC_PRIVATE_DEPS=1 installs the requirements into a cached dir next to the wrapper instead of the users python
+PRIVATE_DEPS = bool(os.environ.get("NRC_PRIVATE_DEPS"))
 
 
-filename = Path(__file__)
-loader:SourceFileLoader = getattr(sys.modules['__main__'], '__loader__', None)
-req = loader.get_data("requirements.txt").decode('utf-8')
+def get_base_dir(loader) -> Path:
+    '''
+    Returns the dir that contains the .pyz (or the src dir when running from source)
+    '''
+    archive = getattr(loader, "archive", None)
+    if archive:
+        return Path(archive).parent
+    return Path(__file__).parent.parent
 
-with tempfile.NamedTemporaryFile("w",delete=False) as f:
-    try:
+def parse_requirements(req:str) -> list[tuple[str,str]]:
+    '''
+    Returns:
+        list of (name, pinned version or None)
+    '''
+    requirements = []
+    for line in req.splitlines():
+        line = line.split("#")[0].strip()
+        if not line:
+            continue
+        name, _, version = line.partition("==")
+        requirements.append((name.strip(), version.strip() or None))
+    return requirements
+
+def find_mismatches(requirements:list[tuple[str,str]]) -> list[str]:
+    '''
+    Checks the installed distributions against the requirements without spawning pip
+
+    Returns:
+        list of requirements that are missing or have the wrong version
+    '''
+    mismatches = []
+    for name, version in requirements:
+        try:
+            installed = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            mismatches.append(name)
+            continue
+        if version and installed != version:
+            mismatches.append(f"{name} ({installed} != {version})")
+    return mismatches
+
+def pip_install(req:str, target:Path = None):
+    with tempfile.NamedTemporaryFile("w",delete=False) as f:
         f.write(req)
-        f.flush()
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", f.name])
-        f.close()
-    except:
-        os.remove(f.name)
+    try:
+        command = [sys.executable, "-m", "pip", "install", "-r", f.name]
+        if target:
+            command.extend(["--target", str(target), "--upgrade"])
+        subprocess.check_call(command)
     finally:
-        os.remove(f.name)
\ No newline at end of file
+        os.remove(f.name)
+
+def ensure_dependencies():
+    '''
+    Makes sure the pinned requirements are importable, pip only runs if something doesnt match
+    '''
+    loader:SourceFileLoader = getattr(sys.modules['__main__'], '__loader__', None)
+    req = loader.get_data("requirements.txt").decode('utf-8')
+    fingerprint = hashlib.md5(f"{req}{sys.version}{sys.platform}".encode()).hexdigest()[:16]
+
+    target = None
+    if PRIVATE_DEPS:
+        target = get_base_dir(loader) / ".nrc-wrapper-deps" / fingerprint
+        sys.path.insert(0, str(target))
+        if (target / ".complete").is_file():
+            return
+
+    mismatches = find_mismatches(parse_requirements(req))
+    if not mismatches:
+        return
+
+    logger.info(f"Installing dependencies, missing or outdated: {', '.join(mismatches)}")
+    try:
+        pip_install(req, target)
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Failed to install dependencies: {e}")
+        return
+    if target:
+        (target / ".complete").touch()
+
+
+ensure_dependencies()
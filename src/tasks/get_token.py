@@ -1,39 +1,55 @@
+import asyncio
 from pathlib import Path
 import time
 import logging
-import jwt
 import networking.api as api
 import json
-import duckdb
+import os
+import background
 import config
+import filelock
+import tracing
 logger = logging.getLogger("Norisk Token")
 
 
 
-async def is_token_expired(token):
+async def token_expires_in(token) -> float:
     '''
-    Checks if the token is expired
+    Returns the seconds until the token expires (negative if it already is)
 
     Args:
         token: a noriskclient token
-    
-    returns:
-        True|False
     '''
+    import jwt
     decoded = jwt.decode(
              token,
             options={"verify_signature": False},
             algorithms=["HS256", "none"]
         )
-    exp_time = decoded.get('exp')
-    current_time = time.time()
-    if current_time > exp_time:
-        logger.warning("Stored Token is expired")
-        return True
-    else:
-        logger.info("Stored Token is valid")
+    return decoded.get('exp') - time.time()
+
+async def is_fresh(token) -> bool:
+    '''
+    True if token stays valid for longer than TOKEN_REFRESH_MARGIN, broken entries of other accounts just count as stale
+    '''
+    import jwt
+    try:
+        return await token_expires_in(token) > config.TOKEN_REFRESH_MARGIN
+    except (jwt.PyJWTError, TypeError):
         return False
 
+async def read_tokens() -> dict:
+    '''
+    Reads all stored tokens from disk
+
+    Returns:
+        profile id -> token
+    '''
+    if Path(f"{config.DATA_DIR}/norisk_data.json").is_file():
+        with open(f"{config.DATA_DIR}/norisk_data.json", "r") as f:
+            return json.load(f)
+    return {}
+
 async def read_token_from_file(uuid):
     '''
     Reads the token from disk
@@ -43,15 +59,15 @@ async def read_token_from_file(uuid):
     Returns:
         Stored token for given profile id: str
     '''
-    if Path(f"{config.DATA_DIR}/norisk_data.json").is_file():
-        with open(f"{config.DATA_DIR}/norisk_data.json", "r") as f:
-            data = json.load(f)
-            if uuid in data:
-                return data[uuid]
+    return (await read_tokens()).get(uuid)
 
 async def get_modrinth_data():
-    data = duckdb.connect(config.DATA_DIR + "/app.db",read_only=True)
-    data = data.sql("SELECT access_token,username,uuid FROM minecraft_users where active = 1").fetchall()
+    def query():
+        import duckdb
+        data = duckdb.connect(config.DATA_DIR + "/app.db",read_only=True)
+        return data.sql("SELECT access_token,username,uuid FROM minecraft_users where active = 1").fetchall()
+    # runs in a thread so a pending request_server_id can make progress meanwhile
+    data = await asyncio.to_thread(query)
     return data[0]
 
 
@@ -70,22 +86,65 @@ async def get_prsim_data():
     
 async def write_token(token:str,player_uuid):
     '''
-    Writes given token to norisk_data.json file
+    Writes given token to norisk_data.json file, locked so launchers sharing DATA_DIR dont drop each others tokens
 
     Args:
         token: norisk token to write 
         player_uuid: profile id
-        path: path to the dir that contains norisk_data.json
     '''
-    if Path(f"{config.DATA_DIR}/norisk_data.json").is_file():
-        with open(f"{config.DATA_DIR}/norisk_data.json", "r") as f:
-            data = json.load(f)
+    path = f"{config.DATA_DIR}/norisk_data.json"
+    async with filelock.FileLock(f"{path}.lock"):
+        data = await read_tokens()
+        data[str(player_uuid)] = token
+        with open(f"{path}.tmp", "w") as f:
+            f.write(json.dumps(data,indent=2))
+        os.replace(f"{path}.tmp", path)
+
+
+async def get_account_data():
+    '''
+    Returns:
+        Minecraft access token, Minecraft IGN, Profile ID
+    '''
+    if config.LAUNCHER == "modrinth":
+        return await get_modrinth_data()
     else:
-        data = {}
-    data[str(player_uuid)] = token
-    with open(f"{config.DATA_DIR}/norisk_data.json", "w") as f:
-        f.write(json.dumps(data,indent=2))
+        return await get_prsim_data()
+
+async def refresh_token(account, server_id_task:asyncio.Task = None) -> str:
+    '''
+    Gets a new norisk token via the mojang session server and stores it
 
+    Args:
+        account: result of get_account_data
+        server_id_task: an already running request_server_id
+    '''
+    mc_token, mc_name, uuid = account
+    with tracing.span("request server id"):
+        norisk_server_id = await (server_id_task or api.request_server_id())
+    with tracing.span("join server session"):
+        await api.join_server_session(mc_token,uuid,norisk_server_id)
+    with tracing.span("validate token"):
+        norisk_token = await api.validate_with_norisk_api(mc_name,norisk_server_id)
+    await write_token(norisk_token,uuid)
+    return norisk_token
+
+async def refresh_in_background():
+    '''
+    Entry point of the detached "refresh-token" process
+    '''
+    try:
+        await refresh_token(await get_account_data())
+        logger.info("Refreshed Token")
+    finally:
+        await api.close_client()
+
+def discard(task:asyncio.Task):
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        # mark a failed request as handled, its result wasnt needed
+        task.exception()
 
 async def main():
     '''
@@ -94,17 +153,26 @@ async def main():
     Returns:
         norisk_token:str
     '''
-    if config.LAUNCHER == "modrinth":
-        mc_token, mc_name, uuid = await get_modrinth_data()
-    else:
-        mc_token, mc_name, uuid = await get_prsim_data()
-
-    stored_token = await read_token_from_file(uuid)
-    if stored_token:
-        if not await is_token_expired(stored_token):
-            return stored_token
-    norisk_server_id = await api.request_server_id()
-    await api.join_server_session(mc_token,uuid,norisk_server_id)
-    norisk_token = await api.validate_with_norisk_api(mc_name,norisk_server_id)
-    await write_token(norisk_token,uuid)
-    return norisk_token
+    stored_tokens = await read_tokens()
+    server_id_task = None
+    if not any([await is_fresh(t) for t in stored_tokens.values()]):
+        # a refresh is likely, the server id doesnt depend on the account so request it while the account data is read
+        server_id_task = asyncio.create_task(api.request_server_id())
+    try:
+        account = await get_account_data()
+
+        stored_token = stored_tokens.get(account[2])
+        if stored_token:
+            expires_in = await token_expires_in(stored_token)
+            if expires_in > config.TOKEN_REFRESH_MARGIN:
+                logger.info("Stored Token is valid")
+                return stored_token
+            if expires_in > 0:
+                logger.info("Stored Token expires soon, refreshing it in the background")
+                background.spawn("refresh-token")
+                return stored_token
+            logger.warning("Stored Token is expired")
+        return await refresh_token(account, server_id_task)
+    finally:
+        if server_id_task:
+            discard(server_id_task)
@@ -1,35 +1,92 @@
 import asyncio
+import contextlib
 from dataclasses import dataclass
-import hashlib
 import json
 import logging
-from pathlib import Path
 from urllib.parse import urljoin
 import os
 import config
+import filelock
+import hashing
+import store
+import tracing
 from networking import api
+from networking.scheduler import get_scheduler
 
 logger = logging.getLogger("Mod processor")
 
-os.makedirs("mods",exist_ok=True)
+repos : dict
+# hash -> {"filename": os.DirEntry}, built by scan_local_files
+local_files = {}
+# set by main, False if a mod couldnt be downloaded
+all_downloaded = False
+
+mod_hash_cache = hashing.HashCache(f"{config.CACHE_DIR}/mod-hashes.json")
+# expected size of a jar that isnt installed in any version and there are no others to go by
+DEFAULT_JAR_SIZE = 1024 * 1024
+# index entries written before this format can point at an nrc-core jar with the cosmetics injected into it
+INDEX_FORMAT = 2
+CORE_MOD_ID = "nrc-core"
+# kept in NRC_MOD_PATH so instances sharing a mod dir share it too, fabric skips hidden files
+INDEX_NAME = ".nrc-index.json"
+# where older wrapper versions kept the index, relative to the instance
+LEGACY_INDEX_PATH = ".nrc-index.json"
+
+def index_path() -> str:
+    return f"{config.NRC_MOD_PATH}/{INDEX_NAME}"
+
+def index_lock() -> filelock.FileLock:
+    '''
+    Held while the mods in NRC_MOD_PATH and their index change, by every instance that uses that dir
+    '''
+    return filelock.FileLock(f"{config.NRC_MOD_PATH}/.nrc-index.lock")
 
-async def calc_hash(file:Path):
+def load_index() -> list | None:
     '''
-    Calculates the md5 hash for given path
-    
+    Reads the index of NRC_MOD_PATH, or the one an older wrapper version left in the instance
+
+    Returns:
+        index_data:list or None if there is none
+    '''
+    for path in (index_path(), LEGACY_INDEX_PATH):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+    return None
+
+async def scan_local_files(index:list) -> dict:
+    '''
+    Builds the inventory of installed jars
+
+    Jars whose size and mtime still match their index entry arent hashed at all,
+    everything else goes through the stat keyed hash cache.
+
     Args:
-        file: path to a file
+        index: installed versions index
+    Returns:
+        local_files:dict
     '''
-    with open(file,'rb') as f:
-        return hashlib.md5(f.read()).hexdigest()
-repos : dict
-local_files = {}
-for f in os.scandir(config.NRC_MOD_PATH):
-    if f.name.endswith(".jar") or f.name.endswith(".jar.disabled"):
-            with open(f,'rb') as file:
-                local_files[hashlib.md5(file.read()).hexdigest()] = {
-                    "filename" : f
-                }
+    global local_files
+    index_by_filename = {entry.get("filename"): entry for entry in index if entry.get("filename")}
+    local_files = {}
+    unknown = []
+    for f in os.scandir(config.NRC_MOD_PATH):
+        if not (f.name.endswith(".jar") or f.name.endswith(".jar.disabled")):
+            continue
+        entry = index_by_filename.get(f.name)
+        if entry:
+            st = f.stat()
+            if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+                local_files[entry.get("hash")] = {"filename": f}
+                continue
+        unknown.append(f)
+
+    for f, digest in zip(unknown, await mod_hash_cache.get_hashes([f.path for f in unknown])):
+        if digest:
+            local_files[digest] = {"filename": f}
+    return local_files
 
 @dataclass
 class MavenSource():
@@ -55,21 +112,59 @@ class ModClass():
     url = None
     filename = None
     download_success = False
+    # bytes the download is expected to take, the real size is only known once it starts
+    expected_size = 0
+
+    def is_current(self) -> bool:
+        return self.local_mod is not None and self.local_mod.version_identifier == self.version_identifier
+
+    def estimate_size(self, default:int) -> int:
+        '''
+        Returns:
+            size of the installed version, new versions are usually about as large
+        '''
+        if self.local_mod:
+            try:
+                return local_files.get(self.local_mod.sha).get("filename").stat().st_size
+            except OSError:
+                pass
+        return default
     
 
     async def download(self):
+        content_store = store.get_store()
+        path = f"{config.NRC_MOD_PATH}/{self.filename}"
         for u in self.url:
-            if await api.download_jar(u,self.filename):
+            # older wrapper versions injected the cosmetics into nrc-core, it has to match the checksum of its repository
+            expected = await api.get_maven_md5(u) if self.ID == CORE_MOD_ID else None
+            # another instance downloading the same url finishes first, then it gets linked from the store
+            async with content_store.lock(content_store.url_path(u).name) if content_store else contextlib.nullcontext():
+                digest = content_store.lookup_url(u) if content_store else None
+                linked = (
+                    content_store is not None and expected in (None, digest) and
+                    await content_store.link(digest, path)
+                )
+                if not linked:
+                    digest = await api.download_jar(u,self.filename,self.expected_size,expected)
+                    if not digest:
+                        continue
+
                 if self.local_mod:
                     old_file:os.DirEntry = (local_files.get(self.local_mod.sha)).get("filename")
-                    if old_file:
-                        os.remove(old_file)
-            
-                self.sha = await calc_hash(f"{config.NRC_MOD_PATH}/{self.filename}")
+                    if old_file and old_file.name != self.filename:
+                        try:
+                            os.remove(old_file)
+                        except OSError as e:
+                            # windows cant delete a jar a running game has open
+                            logger.warning(f"Failed to remove the old version {old_file.name}: {e}")
+
+                self.sha = digest
+                if linked:
+                    logger.info(f"Linked {self.filename} from the content store")
+                elif content_store:
+                    content_store.add(path, self.sha, url=u)
                 self.download_success = True
                 break
-            else:
-                continue
             
 
 
@@ -93,23 +188,29 @@ class ModClass():
             self.url = [urljoin(repos.get(self.source.repositoryRef), artifact_path)]
     
     async def process(self):
-        if self.local_mod:
-            if self.local_mod.version_identifier == self.version_identifier:
-                #logger.info(f"No version mismatch detected skipping {self.ID}")
-                self.sha = self.local_mod.sha
-                self.download_success = True
-                return
+        if self.is_current():
+            #logger.info(f"No version mismatch detected skipping {self.ID}")
+            self.sha = self.local_mod.sha
+            self.filename = local_files.get(self.sha).get("filename").name
+            self.download_success = True
+            return
  
         await self.build_url()
         await self.download()
 
 
     async def serialize(self):
-        return {
+        st = os.stat(f"{config.NRC_MOD_PATH}/{self.filename}")
+        entry = {
+            "format": INDEX_FORMAT,
             "id": self.ID,
             "hash": self.sha,
-            "version": self.version_identifier
+            "version": self.version_identifier,
+            "filename": self.filename,
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns
         }
+        return entry
 
 
 
@@ -147,10 +248,13 @@ async def new_modclass(mod):
 
 async def write_to_index_file(data:list):
     '''
-    Writes data to  ".nrc-index.json" index file
+    Writes data to the ".nrc-index.json" index file, replaced atomically so readers never see half of it
     '''
-    with open(".nrc-index.json","w") as f:
+    path = index_path()
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path,"w") as f:
         json.dump(data,f,indent=2)
+    os.replace(temp_path, path)
 
 async def read_index():
     '''
@@ -159,11 +263,21 @@ async def read_index():
     Returns:
         index_data:list
     '''
-    try:
-        with open(".nrc-index.json") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+    return load_index() or []
+
+def match_index(index:list) -> dict:
+    '''
+    Matches the index against the scanned jars
+
+    Returns:
+        index entries by mod id whose jar is installed
+    '''
+    # older wrapper versions injected the cosmetics into nrc-core and stored the hash of the patched jar,
+    # nothing in the entry marks it so nrc-core from an older index is downloaded again once
+    return {
+        entry.get("id"): entry for entry in index
+        if entry.get("hash") in local_files and not (entry.get("id") == CORE_MOD_ID and entry.get("format", 1) < INDEX_FORMAT)
+    }
 
 async def index_to_modclass(index_entry):
     mod = ModClass(
@@ -177,11 +291,23 @@ async def index_to_modclass(index_entry):
 
 
 async def main(mods, repositories):
-    global repos
+    '''
+    Syncs the mods while holding the index lock, a second launcher using the same mod dir waits and then finds them installed
+    '''
+    os.makedirs(config.NRC_MOD_PATH,exist_ok=True)
+    async with index_lock() as lock:
+        if lock.contended:
+            logger.info("Waited for another launcher to sync the mods")
+        await sync_mods(mods, repositories)
+
+async def sync_mods(mods, repositories):
+    global repos, all_downloaded
     repos = repositories
-    tasks = []
     # get remote modclasses
-    index = await read_index()
+    with tracing.span("mods scan"):
+        index = await read_index()
+        await scan_local_files(index)
+    index_by_id = match_index(index)
     mod_classes = []
     index_mods_seen = set()
 
@@ -189,29 +315,42 @@ async def main(mods, repositories):
         mod: ModClass = await new_modclass(m)
         if mod is None:
             continue
-        for index_entry in index:
-            if local_files.get(index_entry.get("hash")):
-                if mod.ID == index_entry.get("id"):
-                    mod.local_mod = await index_to_modclass(index_entry)
-                    index_mods_seen.add(mod.ID)
-                    break
+        index_entry = index_by_id.get(mod.ID)
+        if index_entry:
+            mod.local_mod = await index_to_modclass(index_entry)
+            index_mods_seen.add(mod.ID)
 
         mod_classes.append(mod)
-        tasks.append(mod.process())
 
-    await asyncio.gather(*tasks)
+    # largest downloads start first, the same way as the assets
+    sizes = [entry.get("size") for entry in index if entry.get("size")]
+    default_size = sum(sizes) // len(sizes) if sizes else DEFAULT_JAR_SIZE
+    outdated = [mod for mod in mod_classes if not mod.is_current()]
+    for mod in outdated:
+        mod.expected_size = mod.estimate_size(default_size)
+    get_scheduler().enqueue("mods", [mod.expected_size for mod in outdated])
+    await asyncio.gather(*(mod.process() for mod in sorted(mod_classes, key=lambda mod: mod.expected_size, reverse=True)))
+    all_downloaded = all(m.download_success for m in mod_classes)
 
     new_index = []
+    content_store = store.get_store()
     for m in mod_classes:
         if m.download_success:
-            new_index.append(await m.serialize())
+            entry = await m.serialize()
+            new_index.append(entry)
+            if content_store:
+                content_store.use(entry.get("hash"))
     
+    in_use = {entry.get("filename") for entry in new_index}
     for index_entry in index:
         if index_entry.get("id") not in index_mods_seen:
             mod_hash = index_entry.get("hash")
             if mod_hash in local_files:
                 local_file_info = local_files[mod_hash]
                 filename = local_file_info.get("filename")
+                if filename.name in in_use:
+                    # a new download replaced it under the same name
+                    continue
                 try:
                     os.remove(filename)
                     logger.info(f"Removed orphaned mod: {filename.name}")
@@ -219,6 +358,7 @@ async def main(mods, repositories):
                     logger.error(f"Failed to remove {filename}: {e}")
     
     await write_to_index_file(new_index)
+    mod_hash_cache.save(prune=True)
     
 
 
@@ -0,0 +1,129 @@
+import contextvars
+import json
+import logging
+import os
+import time
+import config
+
+logger = logging.getLogger("Trace")
+
+_started = time.perf_counter()
+_events: list[dict] = []
+# chrome traces need spans on one thread to nest, so overlapping spans are spread over lanes (shown as threads)
+_lanes: list[bool] = []
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+def enabled() -> bool:
+    return bool(config.TRACE_PATH)
+
+class Span():
+    '''
+    Timed section of the launch, ends up as a complete event ("ph": "X") in the trace
+    '''
+    def __init__(self, name:str, category:str, args:dict):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.lane = 0
+        self.start = 0.0
+        self.token = None
+
+    def __enter__(self):
+        self.lane = next((i for i, busy in enumerate(_lanes) if not busy), len(_lanes))
+        if self.lane == len(_lanes):
+            _lanes.append(True)
+        _lanes[self.lane] = True
+        self.start = time.perf_counter()
+        self.token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _current.reset(self.token)
+        _lanes[self.lane] = False
+        if exc is not None:
+            self.args["error"] = repr(exc)
+        _events.append({
+            "name": self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": round((self.start - _started) * 1_000_000),
+            "dur": round((end - self.start) * 1_000_000),
+            "pid": os.getpid(),
+            "tid": self.lane,
+            "args": self.args
+        })
+        return False
+
+    def set(self, **args):
+        self.args.update(args)
+
+class NoopSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+_noop = NoopSpan()
+
+def span(name:str, category:str = "phase", **args) -> Span | NoopSpan:
+    '''
+    Records the with block as a span if tracing is enabled
+
+    Args:
+        name: shown in the trace and the summary
+        category: "phase" for launch phases, "download" for single files
+        args: extra data shown with the span, more can be added with set or annotate
+    '''
+    if not enabled():
+        return _noop
+    return Span(name, category, args)
+
+def annotate(**args):
+    '''
+    Adds args to the innermost span of the current task
+    '''
+    current = _current.get()
+    if current is not None:
+        current.set(**args)
+
+def summary() -> str:
+    '''
+    Returns:
+        one line with the duration of every phase and the download totals
+    '''
+    phases = {}
+    downloads = 0
+    size = 0
+    retries = 0
+    failed = 0
+    for event in sorted(_events, key=lambda e: e["ts"]):
+        if event["cat"] == "download":
+            downloads += 1
+            size += event["args"].get("bytes", 0)
+            retries += event["args"].get("retries", 0)
+            failed += "error" in event["args"]
+        else:
+            phases[event["name"]] = phases.get(event["name"], 0) + event["dur"]
+    parts = [f"{name} {duration / 1_000_000:.2f}s" for name, duration in phases.items()]
+    parts.append(f"{downloads} downloads {size / 1024 / 1024:.1f} MiB, {retries} retries, {failed} failed")
+    return " | ".join(parts)
+
+def finish():
+    '''
+    Writes the chrome trace (open it in chrome://tracing or ui.perfetto.dev) and logs the summary
+    '''
+    if not enabled() or not _events:
+        return
+    try:
+        with open(config.TRACE_PATH, "w") as f:
+            json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, f)
+    except OSError as e:
+        logger.warning(f"Failed to write trace to {config.TRACE_PATH}: {e}")
+        return
+    logger.info(f"{summary()} -> {config.TRACE_PATH}")